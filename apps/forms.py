@@ -2,10 +2,11 @@ import re
 
 from fastapi import Form, File, UploadFile
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select, exists, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from apps import models
-from apps.hashing import Hasher
+from apps.hashing import hashing_pool
 
 
 class EmployeeForm(BaseModel):
@@ -33,7 +34,7 @@ class RegisterForm(BaseModel):
     password: str
     confirm_password: str
 
-    def is_valid(self, db: Session):
+    async def is_valid(self, db: AsyncSession):
         errors = []
         if self.confirm_password != self.password:
             errors.append('Password did not match!')
@@ -42,13 +43,13 @@ class RegisterForm(BaseModel):
         if not re.search(regex, self.email):
             errors.append('Must be a valid email address')
         self.confirm_password = None
-        q = db.query(models.Users).filter(models.Users.email == self.email)
-        exists = db.query(q.exists()).first()[0]
+        query = select(exists().where(models.Users.email == self.email))
 
-        if exists:
+        if await db.scalar(query):
             errors.append('Must be a unique email address')
 
-        self.password = Hasher.get_password_hash(self.password)
+        if not errors:
+            self.password = await hashing_pool.hash(self.password)
         return errors
 
     @classmethod
@@ -66,14 +67,19 @@ class LoginForm(BaseModel):
     email: str
     password: str
 
-    def is_valid(self, db: Session):
+    async def is_valid(self, db: AsyncSession):
         errors = []
 
-        user: models.Users = db.query(models.Users).filter(models.Users.email == self.email).first()
+        user: models.Users = await db.scalar(select(models.Users).where(models.Users.email == self.email))
         if not user:
             errors.append('User not found!')
-        elif not Hasher.verify_password(self.password, user.password):
-            errors.append('Password does not match!')
+        else:
+            verified, new_hash = await hashing_pool.verify(self.password, user.password)
+            if not verified:
+                errors.append('Password does not match!')
+            elif new_hash:
+                await db.execute(update(models.Users).where(models.Users.id == user.id).values(password=new_hash))
+                await db.commit()
 
         return errors, user
 
@@ -126,12 +132,13 @@ class ForgotPassword(BaseModel):
     password: str
     confirm_password: str
 
-    def is_valid(self, db: Session):
+    async def is_valid(self, db: AsyncSession):
         errors = []
         if self.confirm_password != self.password:
             errors.append('Password did not match!')
         self.confirm_password = None
-        self.password = Hasher.get_password_hash(self.password)
+        if not errors:
+            self.password = await hashing_pool.hash(self.password)
         return errors
 
     @classmethod
@@ -1,6 +1,16 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
+from starlette import status
+
+from config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
 
 
 class Hasher:
@@ -11,3 +21,108 @@ class Hasher:
     @staticmethod
     def get_password_hash(password):
         return pwd_context.hash(password)
+
+    @staticmethod
+    def verify_and_update(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+        """(matches, new hash) - the new hash is set when the stored one uses an outdated cost or scheme."""
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashingPool:
+    """Dedicated threads for bcrypt so hashing spikes never starve the shared threadpool.
+
+    bcrypt releases the GIL, so `workers` threads hash on up to `workers` cores. At most `max_pending` calls
+    may wait or run at once; beyond that callers get a 503 with Retry-After instead of piling up behind the queue.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0  # total time accepted calls waited for a thread
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running_lock = threading.Lock()  # `running` is counted on the worker threads
+
+    def _call(self, submitted: float, func, *args):
+        with self._running_lock:
+            self.running += 1
+            self.wait_seconds += time.perf_counter() - submitted
+        try:
+            return func(*args)
+        finally:
+            with self._running_lock:
+                self.running -= 1
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail='Too many login attempts, retry shortly', headers={'Retry-After': '1'})
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._call, time.perf_counter(), func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(Hasher.get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        return await self.run(Hasher.verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        """Queue depth is `pending - running`: calls accepted but still waiting for a thread."""
+        return {
+            'workers': self.workers,
+            'pending': self.pending,
+            'running': self.running,
+            'queued': self.pending - self.running,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(workers=settings.HASH_WORKERS, max_pending=settings.HASH_MAX_PENDING)
+
+
+def benchmark(rounds: int, seconds: float = 3.0) -> dict:
+    """Hashes per second at `rounds` on one thread and on one thread per core."""
+    import os
+    import time
+
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+
+    def hash_for(deadline):
+        count = 0
+        while time.perf_counter() < deadline:
+            context.hash('benchmark-password')
+            count += 1
+        return count
+
+    cores = os.cpu_count() or 1
+    single = hash_for(time.perf_counter() + seconds) / seconds
+    with ThreadPoolExecutor(max_workers=cores) as executor:
+        deadline = time.perf_counter() + seconds
+        parallel = sum(executor.map(hash_for, [deadline] * cores)) / seconds
+    return {'rounds': rounds, 'cores': cores, 'single': single, 'parallel': parallel, 'per_core': parallel / cores}
+
+
+if __name__ == '__main__':
+    import sys
+
+    for cost in [int(value) for value in sys.argv[1:]] or [settings.BCRYPT_ROUNDS]:
+        result = benchmark(cost)
+        print('rounds={rounds} cores={cores}: {single:.1f}/s single thread, '
+              '{parallel:.1f}/s total, {per_core:.1f}/s per core'.format(**result))
@@ -1,9 +1,9 @@
 import typing as t
 from datetime import datetime
 
-from sqlalchemy import Boolean, Numeric, SmallInteger, text, DateTime, func, Text
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Boolean, Numeric, SmallInteger, text, DateTime, func, Text, Computed, Index, DDL, event
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, JSON
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
 from sqlalchemy.orm import relationship
 
@@ -40,15 +40,38 @@ class Category(Base):
     id: int = Column(Integer, primary_key=True)
     name: str = Column(String(50), nullable=False)
     products = relationship('Product', back_populates='category')
+    count = relationship('CategoryCount', back_populates='category', uselist=False)
+
+
+class CategoryCount(Base):
+    """Products per category, kept up to date by triggers on product (see below); the browse facets."""
+    category_id: int = Column(Integer, ForeignKey('category.id', ondelete='CASCADE'), primary_key=True)
+    category = relationship('Category', back_populates='count')
+    products: int = Column(Integer, nullable=False, server_default=text('0'))
 
 
 class Product(Base):
+    __table_args__ = (
+        Index('ix_product_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_product_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_product_category', 'category_id', 'id'),  # category browse, keyset on id
+        Index('ix_product_specifications', 'specifications', postgresql_using='gin',
+              postgresql_ops={'specifications': 'jsonb_path_ops'}),  # @> spec filters
+    )
+
     id: int = Column(Integer, primary_key=True)
     name: str = Column(String(50), nullable=False)
     price: float = Column(Numeric(9, 2), nullable=False)
     discount: int = Column(SmallInteger, server_default=text('0'))
     description: str = Column(String(512))
-    specifications: dict = Column(JSONB, server_default=text("'{}'::jsonb"))
+    specifications: dict = Column(JSONB, server_default=text("'{}'"))
+    updated_at: datetime = Column(DateTime, server_default=func.now(), onupdate=datetime.now)
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'B') || "
+        "setweight(jsonb_to_tsvector('simple', coalesce(specifications, '{}'), '[\"string\"]'), 'C')",
+        persisted=True
+    ))
 
     author_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'))
     author = relationship('Users', back_populates='products')
@@ -56,6 +79,16 @@ class Product(Base):
     category_id: int = Column(Integer, ForeignKey('category.id', ondelete='CASCADE'), nullable=False)
     category = relationship('Category', back_populates='products')
 
+    # Kept up to date from review by triggers (see below): starred reviews, their sum and one column per star
+    rating_count: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_sum: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_1: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_2: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_3: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_4: int = Column(Integer, nullable=False, server_default=text('0'))
+    rating_5: int = Column(Integer, nullable=False, server_default=text('0'))
+    like_count: int = Column(Integer, nullable=False, server_default=text('0'))  # kept up to date by triggers on like
+
     images = relationship('ProductImage', back_populates='product')
     card = relationship('Card', back_populates='product')
     like = relationship('Like', back_populates='product')
@@ -65,15 +98,131 @@ class Product(Base):
     def discount_price(self):
         return self.price - round(self.price * self.discount / 100, 2)
 
+    @property
+    def rating_average(self):
+        return round(self.rating_sum / self.rating_count, 1) if self.rating_count else None
+
+    @property
+    def rating_histogram(self):
+        """(star, reviews) from 5 down to 1."""
+        return [(star, getattr(self, f'rating_{star}')) for star in range(5, 0, -1)]
+
+
+event.listen(Base.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+# The counter functions and triggers, in install order; see install_counters.
+COUNTER_DDL: t.List[DDL] = []
+TRANSITION_TABLES = {
+    'INSERT': 'NEW TABLE AS new_rows',
+    'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'DELETE': 'OLD TABLE AS old_rows',
+}
+
+
+def trigger(name: str, operation: str, table: str, function: str) -> t.List[DDL]:
+    """Statement level trigger with transition tables, dropped first so it can be installed again."""
+    return [
+        DDL(f'DROP TRIGGER IF EXISTS {name} ON {table}'),
+        DDL(f'CREATE TRIGGER {name} AFTER {operation} ON {table} REFERENCING {TRANSITION_TABLES[operation]} '
+            f'FOR EACH STATEMENT EXECUTE FUNCTION {function}()'),
+    ]
+
+
+# Statement level triggers with transition tables: a COPY of 100k products (seed.py) is one grouped upsert,
+# not 100k single row ones. Category changes only touch the counters of the categories involved.
+COUNTER_DDL.append(DDL("""
+CREATE OR REPLACE FUNCTION categorycount_refresh() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO categorycount (category_id, products)
+        SELECT category_id, count(*) FROM new_rows GROUP BY category_id ORDER BY category_id
+        ON CONFLICT (category_id) DO UPDATE SET products = categorycount.products + excluded.products;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO categorycount (category_id, products)
+        SELECT moved.category_id, sum(moved.delta)
+        FROM old_rows JOIN new_rows USING (id)
+        CROSS JOIN LATERAL (VALUES (old_rows.category_id, -1), (new_rows.category_id, 1)) moved (category_id, delta)
+        WHERE old_rows.category_id <> new_rows.category_id
+        GROUP BY moved.category_id ORDER BY moved.category_id
+        ON CONFLICT (category_id) DO UPDATE SET products = categorycount.products + excluded.products;
+    ELSE
+        -- an UPDATE, not an upsert: deleting a category cascades here after its counter row is gone
+        UPDATE categorycount SET products = categorycount.products - removed.products
+        FROM (SELECT category_id, count(*) AS products FROM old_rows GROUP BY category_id) removed
+        WHERE categorycount.category_id = removed.category_id;
+    END IF;
+    RETURN NULL;
+END $$
+"""))
+COUNTER_DDL += trigger('product_categorycount_insert', 'INSERT', 'product', 'categorycount_refresh')
+COUNTER_DDL += trigger('product_categorycount_update', 'UPDATE', 'product', 'categorycount_refresh')
+COUNTER_DDL += trigger('product_categorycount_delete', 'DELETE', 'product', 'categorycount_refresh')
+
+
+class SpecFacet(Base):
+    """Products per string specification value, kept up to date by triggers on product; the filter sidebar."""
+    key: str = Column(Text, primary_key=True)
+    value: str = Column(Text, primary_key=True)
+    products: int = Column(Integer, nullable=False, server_default=text('0'))
+
+
+# Like categorycount_refresh; specfacet has no foreign key, so deletes can be upserts too. Updates only count
+# products whose specifications changed.
+COUNTER_DDL.append(DDL("""
+CREATE OR REPLACE FUNCTION specfacet_refresh() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO specfacet (key, value, products)
+        SELECT spec.key, spec.value #>> '{}', count(*)
+        FROM new_rows CROSS JOIN LATERAL jsonb_each(new_rows.specifications) spec
+        WHERE jsonb_typeof(spec.value) = 'string'
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (key, value) DO UPDATE SET products = specfacet.products + excluded.products;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO specfacet (key, value, products)
+        SELECT spec.key, spec.value #>> '{}', sum(spec.delta)
+        FROM old_rows JOIN new_rows USING (id)
+        CROSS JOIN LATERAL (
+            SELECT key, value, -1 AS delta FROM jsonb_each(old_rows.specifications)
+            UNION ALL
+            SELECT key, value, 1 FROM jsonb_each(new_rows.specifications)
+        ) spec
+        WHERE old_rows.specifications IS DISTINCT FROM new_rows.specifications
+            AND jsonb_typeof(spec.value) = 'string'
+        GROUP BY 1, 2 HAVING sum(spec.delta) <> 0 ORDER BY 1, 2
+        ON CONFLICT (key, value) DO UPDATE SET products = specfacet.products + excluded.products;
+    ELSE
+        INSERT INTO specfacet (key, value, products)
+        SELECT spec.key, spec.value #>> '{}', -count(*)
+        FROM old_rows CROSS JOIN LATERAL jsonb_each(old_rows.specifications) spec
+        WHERE jsonb_typeof(spec.value) = 'string'
+        GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (key, value) DO UPDATE SET products = specfacet.products + excluded.products;
+    END IF;
+    RETURN NULL;
+END $$
+"""))
+COUNTER_DDL += trigger('product_specfacet_insert', 'INSERT', 'product', 'specfacet_refresh')
+COUNTER_DDL += trigger('product_specfacet_update', 'UPDATE', 'product', 'specfacet_refresh')
+COUNTER_DDL += trigger('product_specfacet_delete', 'DELETE', 'product', 'specfacet_refresh')
+
 
 class ProductImage(Base):
+    __table_args__ = (
+        Index('ix_productimage_product', 'product_id', 'id'),  # first image per product, see load_first_images
+    )
+
     id: int = Column(Integer, primary_key=True)
     image: str = Column(String(255))
+    variants: dict = Column(JSONB, server_default=text("'{}'"))  # {size: {format: path}}
     product_id: int = Column(Integer, ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
     product = relationship('Product', back_populates='images')
 
 
 class Card(Base):
+    __table_args__ = (UniqueConstraint('user_id', 'product_id'),)
+
     id: int = Column(Integer, primary_key=True)
     user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     user = relationship('Users', back_populates='card')
@@ -83,6 +232,8 @@ class Card(Base):
 
 
 class Like(Base):
+    __table_args__ = (UniqueConstraint('user_id', 'product_id'),)
+
     id: int = Column(Integer, primary_key=True)
     user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     user = relationship('Users', back_populates='like')
@@ -91,7 +242,32 @@ class Like(Base):
     total = Column(Integer, server_default=text('0'))
 
 
+# Likes are only ever inserted and deleted (the like toggle, like_list, cascades), never moved between products.
+COUNTER_DDL.append(DDL("""
+CREATE OR REPLACE FUNCTION like_count_refresh() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE product SET like_count = product.like_count + added.likes
+        FROM (SELECT product_id, count(*) AS likes FROM new_rows GROUP BY product_id) added
+        WHERE product.id = added.product_id;
+    ELSE
+        UPDATE product SET like_count = product.like_count - removed.likes
+        FROM (SELECT product_id, count(*) AS likes FROM old_rows GROUP BY product_id) removed
+        WHERE product.id = removed.product_id;
+    END IF;
+    RETURN NULL;
+END $$
+"""))
+COUNTER_DDL += trigger('like_count_insert', 'INSERT', '"like"', 'like_count_refresh')
+COUNTER_DDL += trigger('like_count_delete', 'DELETE', '"like"', 'like_count_refresh')
+
+
 class Review(Base):
+    __table_args__ = (
+        UniqueConstraint('user_id', 'product_id'),  # one review per user and product, see the star route
+        Index('ix_review_product', 'product_id', 'created_at'),
+    )
+
     id: int = Column(Integer, primary_key=True)
     title: str = Column(String(255))
     text: str = Column(Text)
@@ -102,6 +278,97 @@ class Review(Base):
     product_id: int = Column(Integer, ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
     product = relationship('Product', back_populates='review')
 
+
+# Applies the changed reviews, as (product_id, star, +1 | -1) rows, to the rating columns of their products.
+# Stars outside 1-5 (NULL: a review without rating) are not counted.
+RATING_UPDATE = """
+        UPDATE product SET
+            rating_count = product.rating_count + delta.count, rating_sum = product.rating_sum + delta.sum,
+            rating_1 = product.rating_1 + delta.r1, rating_2 = product.rating_2 + delta.r2,
+            rating_3 = product.rating_3 + delta.r3, rating_4 = product.rating_4 + delta.r4,
+            rating_5 = product.rating_5 + delta.r5
+        FROM (
+            SELECT product_id, sum(sign) AS count, sum(sign * star) AS sum,
+                sum(sign * (star = 1)::int) AS r1, sum(sign * (star = 2)::int) AS r2,
+                sum(sign * (star = 3)::int) AS r3, sum(sign * (star = 4)::int) AS r4,
+                sum(sign * (star = 5)::int) AS r5
+            FROM ({changes}) changes WHERE star BETWEEN 1 AND 5 GROUP BY product_id
+        ) delta
+        WHERE product.id = delta.product_id;"""
+COUNTER_DDL.append(DDL("""
+CREATE OR REPLACE FUNCTION review_rating_refresh() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN%s
+    ELSIF TG_OP = 'UPDATE' THEN%s
+    ELSE%s
+    END IF;
+    RETURN NULL;
+END $$
+""" % (
+    RATING_UPDATE.format(changes='SELECT product_id, star, 1 AS sign FROM new_rows'),
+    RATING_UPDATE.format(changes=(
+        'SELECT change.* FROM old_rows JOIN new_rows USING (id) CROSS JOIN LATERAL (VALUES '
+        '(old_rows.product_id, old_rows.star, -1), (new_rows.product_id, new_rows.star, 1)) '
+        'change (product_id, star, sign) '
+        'WHERE (old_rows.product_id, old_rows.star) IS DISTINCT FROM (new_rows.product_id, new_rows.star)'
+    )),
+    RATING_UPDATE.format(changes='SELECT product_id, star, -1 AS sign FROM old_rows'),
+)))
+COUNTER_DDL += trigger('review_rating_insert', 'INSERT', 'review', 'review_rating_refresh')
+COUNTER_DDL += trigger('review_rating_update', 'UPDATE', 'review', 'review_rating_refresh')
+COUNTER_DDL += trigger('review_rating_delete', 'DELETE', 'review', 'review_rating_refresh')
+
+
+def install_counters(connection):
+    """(Re)create the counter functions and triggers; also for databases created before them, see rebuild_counters."""
+    for statement in COUNTER_DDL:
+        connection.execute(statement)
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def _install_counters(target, connection, **kw):
+    # once all tables exist: the functions and triggers span product, categorycount, specfacet, "like" and review
+    if connection.dialect.name == 'postgresql':
+        install_counters(connection)
+
+
+class Outbox(Base):
+    """Emails waiting to be sent; rows are written in the same transaction as the change they announce."""
+    __table_args__ = (
+        Index('ix_outbox_pending', 'next_attempt_at', postgresql_where=text("status IN ('pending', 'sending')")),
+    )
+
+    id: int = Column(Integer, primary_key=True)
+    recipient: str = Column(String(255), nullable=False)
+    subject: str = Column(String(255), nullable=False)
+    html: str = Column(Text, nullable=False)
+    # pending | sending | sent | failed; a sending row's next_attempt_at is when its claim runs out
+    status: str = Column(String(10), nullable=False, server_default=text("'pending'"))
+    attempts: int = Column(SmallInteger, nullable=False, server_default=text('0'))
+    last_error: str = Column(Text)
+    next_attempt_at: datetime = Column(DateTime, nullable=False, server_default=func.now())
+    created_at: datetime = Column(DateTime, server_default=func.now())
+    sent_at: datetime = Column(DateTime)
+
+
+class Job(Base):
+    """Queued background work and its status; see apps/utils/jobs.py. Portable to SQLite for JOB_DATABASE_URL."""
+    __table_args__ = (
+        Index('ix_job_due', 'status', 'run_at'),
+    )
+
+    id: int = Column(Integer, primary_key=True)
+    name: str = Column(String(100), nullable=False)
+    payload: dict = Column(JSON().with_variant(JSONB, 'postgresql'), nullable=False, default=dict)
+    status: str = Column(String(10), nullable=False, default='queued')  # queued | running | done | failed
+    attempts: int = Column(SmallInteger, nullable=False, default=0)
+    max_attempts: int = Column(SmallInteger, nullable=False, default=5)
+    last_error: str = Column(Text)
+    run_at: datetime = Column(DateTime, nullable=False, default=func.now())  # the job database's clock, as in claim
+    locked_at: datetime = Column(DateTime)
+    created_at: datetime = Column(DateTime, default=func.now())
+    finished_at: datetime = Column(DateTime)
+
 #
 # class Company(Base):
 #     id: int = Column(Integer, primary_key=True)
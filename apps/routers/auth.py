@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Request, Depends, Response, HTTPException
-from sqlalchemy import update
-from sqlalchemy.orm import Session
+from sqlalchemy import update, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-from starlette.background import BackgroundTasks
 from starlette.responses import RedirectResponse
 
 from apps import forms, models
 from apps.forms import ForgotPassword
-from apps.utils.send_email import send_verification_email, decode_data
+from apps.utils.cache import user_cache
+from apps.utils.outbox import outbox
+from apps.utils.send_email import queue_verification_email, decode_data
 from apps.utils.token import check_token
 from config import manager, templates
 from database import get_db
@@ -31,25 +32,26 @@ def auth_logout(request: Request, current_user=Depends(manager)):
 
 
 @auth.get('/activate/{uid}/{token}', name='activate_user')
-def auth_logout(uid: str, token: str, db: Session = Depends(get_db)):
-    pk = decode_data(uid)
-    user = db.query(models.Users).where(models.Users.id == pk).first()
-
-    if check_token(user, token):
-        db.query(models.Users).where(models.Users.id == user.id).update({'is_active': True})
-        db.commit()
+async def auth_logout(uid: str, token: str, db: AsyncSession = Depends(get_db)):
+    pk = int(decode_data(uid))
+    user = await db.scalar(select(models.Users).where(models.Users.id == pk))
+
+    if user and check_token(user, token):
+        await db.execute(update(models.Users).where(models.Users.id == user.id).values(is_active=True))
+        await db.commit()
+        user_cache.pop(user.email)
         return RedirectResponse('/login', status.HTTP_302_FOUND)
     else:
         raise HTTPException(status.HTTP_404_NOT_FOUND)
 
 
 @auth.post('/login', name='login')
-def auth_login(
+async def auth_login(
         request: Request,
         form: forms.LoginForm = Depends(forms.LoginForm.as_form),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_db)
 ):
-    errors, user = form.is_valid(db)
+    errors, user = await form.is_valid(db)
     if errors:
         context = {
             'request': request,
@@ -79,10 +81,10 @@ def forgot_password(request: Request):
 
 
 @auth.post('/forgot_password', name='forgot_password')
-def forgot_password(request: Request, background_task: BackgroundTasks,
-                    form: ForgotPassword = Depends(ForgotPassword.as_form),
-                    db: Session = Depends(get_db)):
-    if errors := form.is_valid(db):
+async def forgot_password(request: Request,
+                          form: ForgotPassword = Depends(ForgotPassword.as_form),
+                          db: AsyncSession = Depends(get_db)):
+    if errors := await form.is_valid(db):
         context = {
             'errors': errors,
             'request': request
@@ -90,12 +92,13 @@ def forgot_password(request: Request, background_task: BackgroundTasks,
         return templates.TemplateResponse('auth/forgot_password.html', context)
     else:
         data = form.dict(exclude_none=True) # noqa
-        user = models.Users(**data) # noqa
         query = update(models.Users).where(models.Users.id == request.state.user.id).values(**data)
-        db.execute(query)
+        user = await db.scalar(query.returning(models.Users))
         host = f'{request.url.scheme}://{request.url.netloc}/activate/'
-        background_task.add_task(send_verification_email, user, host)
-        db.commit()
+        queue_verification_email(db, user, host)
+        await db.commit()
+        outbox.wake()
+        user_cache.pop(request.state.user.email)
         return RedirectResponse('/login', status.HTTP_303_SEE_OTHER)
 
 
@@ -108,13 +111,12 @@ def register_page(request: Request):
 
 
 @auth.post('/register', name='register')
-def register_page(
+async def register_page(
         request: Request,
-        background_task: BackgroundTasks,
         form: forms.RegisterForm = Depends(forms.RegisterForm.as_form),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
 ):
-    if errors := form.is_valid(db):
+    if errors := await form.is_valid(db):
         context = {
             'errors': errors,
             'request': request
@@ -124,9 +126,11 @@ def register_page(
         data = form.dict(exclude_none=True) # noqa
         user = models.Users(**data)
         db.add(user)
+        await db.flush()
         host = f'{request.url.scheme}://{request.url.netloc}/activate/'
-        background_task.add_task(send_verification_email, user, host)
-        db.commit()
+        queue_verification_email(db, user, host)
+        await db.commit()
+        outbox.wake()
         return RedirectResponse('/login', status.HTTP_303_SEE_OTHER)
 
 
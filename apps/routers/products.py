@@ -1,18 +1,26 @@
-import os
-import shutil
 from math import ceil, floor
 from typing import Optional
 
-from fastapi import APIRouter, Request, Depends, Form
-from sqlalchemy import update, select
-from sqlalchemy.orm import Session
-from starlette.background import BackgroundTasks
+from fastapi import APIRouter, Request, Depends, Form, HTTPException
+from sqlalchemy import update, select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from starlette import status
 from starlette.responses import RedirectResponse
 from starlette.status import HTTP_303_SEE_OTHER
 
 from apps import models
-from apps.forms import ProductForm, EditForm, ReviewForm, StarForm
+from apps.forms import ProductForm, EditForm, ReviewForm
 from apps.models import Users
+from apps.search import search_backend
+from apps.utils.cache import user_cache
+from apps.utils.cart import cart_summary, invalidate_cart
+from apps.utils.catalog import load_product_page, load_products, product_count, category_facets
+from apps.utils.catalog import spec_filters, filter_by_specs, spec_facets
+from apps.utils.jobs import enqueue
+from apps.utils.page_cache import cache_page, purge, product_tag, category_tag
+from apps.utils.uploads import store_upload
 from config import manager
 from config import templates
 from database import get_db
@@ -21,45 +29,55 @@ product_api = APIRouter()
 
 
 @product_api.get('/', name='product_list')
-async def public_page(request: Request, db: Session = Depends(get_db),offset: int = 0, limit: int = 6):
-    products = db.query(models.Product).order_by(-models.Product.id).limit(limit).offset(offset)
-    image = db.query(models.ProductImage).all()
-    users = db.query(models.Users).all()
-    user = db.query(models.Users).filter(models.Users.id == request.state.user.id).first()
-    count = db.query(models.Product).count()
-    # for i in products:
-    #     print(i.product.images)
-    counter = 0
-    for _ in products:
-        counter += 1
-    # res.append(db.query(models.Card).filter(request.state.user.id == models.Card.id))
-    # res.append(card.total)
-    # print(res)
-    result = db.execute(select(models.Card).where(models.Card.user_id == request.state.user.id)).fetchall()
-    print(type(result))
-    c = 0
-    for i in result:
-        c += i[0].total
-    print(c)
+async def public_page(request: Request, db: AsyncSession = Depends(get_db),
+                      cursor: Optional[str] = None, limit: int = 6, category: Optional[int] = None):
+    query = select(models.Product)
+    if category is not None:
+        query = query.where(models.Product.category_id == category)
+    specs = spec_filters(request.query_params)
+    user = request.state.user
+    page, images, liked = await load_product_page(db, filter_by_specs(query, specs), cursor, limit,
+                                                  user.id if user else None)
+    facets = await category_facets(db)
+    specification_facets = await spec_facets(db)
+    if specs:
+        count = None  # the counters cannot answer a combination of filters; don't COUNT(*) for the page number
+    elif category is not None:
+        count = next((products for facet, products in facets if facet.id == category), 0)
+    else:
+        count = await product_count.get(db)
+    summary = await cart_summary(db, user.id if user else None)
+    cache_page(request, 'products')
     context = {
         'request': request,
-        'products': products,
-        'users': users,
-        'count2': c,
+        'products': page.items,
+        'count2': summary.items,
         'limit': limit,
-        'offset': offset,
-        'count': ceil(count / limit),
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'page_name': 'product_list',
+        'query': None,
+        'category': category,
+        'facets': facets,
+        'count': ceil(count / limit) if count is not None else None,
         'counter': count,
         'user': user,
-        'images': image
+        'images': images,
+        'liked': liked,
+        'specs': specs,
+        'spec_facets': specification_facets,
     }
     return templates.TemplateResponse('products/product-list.html', context)
 
 
 @product_api.get('/detail/{pk}', name='product_detail')
-async def private_page(request: Request, pk: int, db: Session = Depends(get_db)):
-    user = db.query(models.Users).filter(models.Users.id == request.state.user.id).first()
-    product = db.query(models.Product).where(models.Product.id == pk).first()
+async def private_page(request: Request, pk: int, db: AsyncSession = Depends(get_db)):
+    user = request.state.user
+    query = select(models.Product).where(models.Product.id == pk) \
+        .options(selectinload(models.Product.category), selectinload(models.Product.images))
+    product = await db.scalar(query)
+    if product is not None:
+        cache_page(request, product_tag(pk), category_tag(product.category_id))
     context = {
         'request': request,
         'user': user,
@@ -69,8 +87,8 @@ async def private_page(request: Request, pk: int, db: Session = Depends(get_db))
 
 
 @product_api.get('/add', name='product_add')
-async def private_page(request: Request, db: Session = Depends(get_db), current_user=Depends(manager)):
-    user = db.query(models.Users).filter(models.Users.id == request.state.user.id).first()
+async def private_page(request: Request, current_user=Depends(manager)):
+    user = current_user
     context = {
         'request': request,
         'user': user
@@ -78,38 +96,40 @@ async def private_page(request: Request, db: Session = Depends(get_db), current_
     return templates.TemplateResponse('products/product-add.html', context)
 
 
-def save_image(images, product_id, db: Session):
+async def save_image(images, product_id, db: AsyncSession):
     if isinstance(images, list):
         images_list = []
         for image in images:
             if len(image.filename):
-                folder = 'media/product/'
-                if not os.path.exists(folder):
-                    os.mkdir(folder)
-                file_url = folder + image.filename
-                with open(file_url, "wb") as buffer:
-                    shutil.copyfileobj(image.file, buffer)
-                    images_list.append(models.ProductImage(product_id=product_id, image=file_url))
+                file_url = await store_upload(image, 'product')
+                images_list.append(models.ProductImage(product_id=product_id, image=file_url))
 
         db.add_all(images_list)
-        db.commit()
+        return images_list
+    return []
 
 
 @product_api.post('/add', name='product_add')
 async def product_add(
         request: Request,
         form: ProductForm = Depends(ProductForm.as_form),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_db),
         current_user=Depends(manager)
 ):
-    user = db.query(models.Users).filter(models.Users.id == request.state.user.id).first()
+    user = current_user
     data = form.dict(exclude_none=True)
     images = data.pop('images')
     data.update({'author_id': current_user.id})
     product = models.Product(**data)
     db.add(product)
-    db.commit()
-    save_image(images, product.id, db)
+    await db.flush()
+    images = await save_image(images, product.id, db)
+    if images:
+        await db.flush()
+        await enqueue(db, 'images.variants', {'image_ids': [image.id for image in images]})
+    await db.commit()
+    search_backend.index_product(product)
+    await purge('products', category_tag(product.category_id))
     context = {
         'request': request,
         'user': user
@@ -118,12 +138,8 @@ async def product_add(
 
 
 @product_api.get('/settings/{id}', name='edit_profile')
-async def settings(request: Request, id: int, db: Session = Depends(get_db)):
-    data = db.query(models.Users).filter(models.Users.id == id).first()
-    # print(data.image)
-    # print(data.banner)
-    print(data.name)
-    print(data.image)
+async def settings(request: Request, id: int, db: AsyncSession = Depends(get_db)):
+    data = await db.get(models.Users, id)
     context = {
         'request': request,
         'data': data,
@@ -132,67 +148,55 @@ async def settings(request: Request, id: int, db: Session = Depends(get_db)):
 
 
 @product_api.post('/settings/{pk}', name='edit_profile')
-async def settings(request: Request, pk: int, db: Session = Depends(get_db),
+async def settings(request: Request, pk: int, db: AsyncSession = Depends(get_db),
                    form: EditForm = Depends(EditForm.as_form)):
-    data = form.dict(exclude_unset=True)
+    data = {'name': form.name, 'email': form.email}
     if len(form.image.filename):
-        file_url = 'media/' + form.image.filename
-        with open(file_url, "wb") as buffer:
-            shutil.copyfileobj(form.image.file, buffer)
-        data.update({'image': file_url})
-    query = update(Users).where(Users.id == pk).values(name=form.name,
-                                                       email=form.email,
-                                                       image=data['image'])
-    db.execute(query)
-    db.commit()
+        data.update({'image': await store_upload(form.image, 'users')})
+    query = update(Users).where(Users.id == pk).values(**data)
+    await db.execute(query)
+    await db.commit()
+    user_cache.pop(form.email)
+    if request.state.user:
+        user_cache.pop(request.state.user.email)
     return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
 
 
 @product_api.post('/card/{product_id}/{user_id}', name='card')
-async def card(request: Request, product_id: int, user_id: int, db: Session = Depends(get_db)):
-    query = db.query(models.Card).filter(models.Card.product_id == product_id).first()
-    print(query)
-    if query:
-        data = update(models.Card).where(models.Card.product_id == product_id).values(product_id=product_id,
-                                                                                      user_id=user_id,
-                                                                                      total=query.total + 1)
-        db.execute(data)
-        db.commit()
-        return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
-    else:
-        db.add(models.Card(user_id=user_id, product_id=product_id,total=1))
-        db.commit()
-        return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
+async def card(request: Request, product_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
+    query = insert(models.Card).values(user_id=user_id, product_id=product_id, total=1).on_conflict_do_update(
+        index_elements=[models.Card.user_id, models.Card.product_id],
+        set_={'total': models.Card.total + 1}
+    )
+    await db.execute(query)
+    await db.commit()
+    invalidate_cart(user_id)
+    return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
 
 
 @product_api.get('/card_list', name='card_list')
-async def card_list(request: Request, db: Session = Depends(get_db)):
-    card = db.query(models.Card).where(models.Card.user_id == request.state.user.id).all()
-    c = 0
-    total = 0
-    for i in card:
-        c += i.product.price
-        total += i.total
-    # print(c)
-    # for i in card:
-    #     print(i.product.name)
+async def card_list(request: Request, db: AsyncSession = Depends(get_db)):
+    user = request.state.user
+    user_id = user.id if user else None
+    query = select(models.Card).options(selectinload(models.Card.product)).where(models.Card.user_id == user_id)
+    card = (await db.scalars(query)).all() if user_id is not None else []
+    summary = await cart_summary(db, user_id)
     context = {
         'request': request,
         'card': card,
-        'count': len(card),
-        'sum': c,
-        'total': total
+        'count': summary.lines,
+        'sum': summary.amount,
+        'total': summary.items
     }
     return templates.TemplateResponse('products/shopping-cart.html', context)
 
 
 @product_api.post('/card_list/{id}', name='remove_card')
-async def card_remove(request: Request, id: int, db: Session = Depends(get_db)):
-    print(id)
-    data = db.query(models.Card).filter(models.Card.product_id == id).first()
-    print(data.id)
-    db.delete(data)
-    db.commit()
+async def card_remove(request: Request, id: int, db: AsyncSession = Depends(get_db)):
+    query = delete(models.Card).where(models.Card.product_id == id, models.Card.user_id == request.state.user.id)
+    await db.execute(query)
+    await db.commit()
+    invalidate_cart(request.state.user.id)
     context = {
         "request": request
     }
@@ -200,10 +204,9 @@ async def card_remove(request: Request, id: int, db: Session = Depends(get_db)):
 
 
 @product_api.get('/like')
-async def like(request: Request, db: Session = Depends(get_db)):
-    card = db.query(models.Like).where(models.Like.user_id == request.state.user.id).all()
-    for i in card:
-        print(i.product.category.name)
+async def like(request: Request, db: AsyncSession = Depends(get_db)):
+    query = select(models.Like).options(selectinload(models.Like.product).selectinload(models.Product.category))
+    card = (await db.scalars(query.where(models.Like.user_id == request.state.user.id))).all()
     context = {
         'request': request,
         'card': card,
@@ -212,87 +215,90 @@ async def like(request: Request, db: Session = Depends(get_db)):
 
 
 @product_api.post('/like/{product_id}/{user_id}', name='like')
-async def card(request: Request, product_id: int, user_id: int, db: Session = Depends(get_db)):
-    query = db.query(models.Like).filter(models.Like.product_id == product_id).first()
-    print(query)
-    if query:
-        db.delete(query)
-        db.commit()
-        return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
-    else:
-        db.add(models.Like(user_id=user_id, product_id=product_id, total=1))
-        db.commit()
-        return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
+async def card(request: Request, product_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
+    query = delete(models.Like).where(models.Like.user_id == user_id, models.Like.product_id == product_id)
+    if not (await db.execute(query.returning(models.Like.id))).first():
+        query = insert(models.Like).values(user_id=user_id, product_id=product_id, total=1)
+        await db.execute(query.on_conflict_do_nothing(index_elements=[models.Like.user_id, models.Like.product_id]))
+    await db.commit()
+    await purge('products', product_tag(product_id))  # like_count shows on both
+    return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
 
 
 @product_api.post('/like_list/{product_id}/{user_id}', name='like_list')
-async def card(request: Request, product_id: int, user_id: int, db: Session = Depends(get_db)):
-    query = db.query(models.Like).filter(models.Like.product_id == product_id).first()
-    if query:
-        db.delete(query)
-        db.commit()
-        return RedirectResponse(url='/like', status_code=HTTP_303_SEE_OTHER)
+async def card(request: Request, product_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
+    query = delete(models.Like).where(models.Like.user_id == user_id, models.Like.product_id == product_id)
+    await db.execute(query)
+    await db.commit()
+    await purge('products', product_tag(product_id))
+    return RedirectResponse(url='/like', status_code=HTTP_303_SEE_OTHER)
 
 
 @product_api.get('/review', name='review')
-async def card_list(request: Request, db: Session = Depends(get_db)):
-    card = db.query(models.Card).where(models.Card.user_id == request.state.user.id).all()
-    c = 0
-    total = 0
-    for i in card:
-        c += i.product.price
-        total += i.total
-    # print(c)
-    # for i in card:
-    #     print(i.product.name)
+async def card_list(request: Request, db: AsyncSession = Depends(get_db)):
+    user = request.state.user
+    user_id = user.id if user else None
+    query = select(models.Card).options(selectinload(models.Card.product)).where(models.Card.user_id == user_id)
+    card = (await db.scalars(query)).all() if user_id is not None else []
+    summary = await cart_summary(db, user_id)
     context = {
         'request': request,
         'card': card,
-        'count': len(card),
-        'sum': c,
-        'total': total
+        'count': summary.lines,
+        'sum': summary.amount,
+        'total': summary.items
     }
     return templates.TemplateResponse('products/shopping-cart.html', context)
 
 
-@product_api.get('/search')
-def search(request: Request, query: Optional[str], db: Session = Depends(get_db), offset: int = 0, limit: int = 6):
-    data = db.query(models.Product).filter(models.Product.name.contains(query)).all()
-    user = db.query(models.Users).filter(models.Users.id == request.state.user.id).first()
-    # products = db.query(models.Product).order_by(-models.Product.id).all()
-    for i in data:
-        print(i.name)
-    count = db.query(models.Product).count()
+@product_api.get('/search', name='search')
+async def search(request: Request, query: Optional[str], db: AsyncSession = Depends(get_db),
+                 cursor: Optional[str] = None, limit: int = 6):
+    page = await search_backend.search(db, query, cursor, limit)
+    user = request.state.user
+    products, images, liked = await load_products(db, page.items, user.id if user else None)
+    cache_page(request, 'products')
     context = {
         'request': request,
-        'products': data,
+        'products': products,
+        'images': images,
+        'liked': liked,
         'user': user,
         'limit': limit,
-        'offset': offset,
-        'counter': count
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'page_name': 'search',
+        'query': query,
+        'category': None,
+        'specs': {}
     }
     return templates.TemplateResponse('products/product-list.html', context)
 
 
-@product_api.post('/review/{product_id}/',name='revieew')
-def review(request: Request, product_id: int, db: Session = Depends(get_db),
-           form: ReviewForm = Depends(ReviewForm.as_form)
-           ):
-    data = form.dict(exclude_none=True)
-    query = models.Review(title=form.title, text=form.text, product_id=product_id,
-                          user_id=request.state.user.id)
-    db.add(query)
-    db.commit()
-
-
-@product_api.post('/star/{product_id}/{count}',name='star')
-def star(request: Request,product_id: int, count: int, form: StarForm = Depends(StarForm.as_form), db: Session = Depends(get_db)):
+@product_api.post('/review/{product_id}/', name='revieew')
+async def review(request: Request, product_id: int, db: AsyncSession = Depends(get_db),
+                 form: ReviewForm = Depends(ReviewForm.as_form)
+                 ):
     data = form.dict(exclude_none=True)
-    query = update(models.Review).filter(product_id == models.Review.product_id).values(
-        star = count,
-        user_id = request.state.user.id,
-        product_id = product_id
+    query = insert(models.Review).values(title=form.title, text=form.text, product_id=product_id,
+                                         user_id=request.state.user.id).on_conflict_do_update(
+        index_elements=[models.Review.user_id, models.Review.product_id],
+        set_={'title': form.title, 'text': form.text}
     )
-    db.execute(query)
-    db.commit()
-    return RedirectResponse(url='/',status_code=HTTP_303_SEE_OTHER)
\ No newline at end of file
+    await db.execute(query)
+    await db.commit()
+    await purge('products', product_tag(product_id))
+
+
+@product_api.post('/star/{product_id}/{count}', name='star')
+async def star(request: Request, product_id: int, count: int, db: AsyncSession = Depends(get_db)):
+    if not 1 <= count <= 5:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST)
+    query = insert(models.Review).values(product_id=product_id, user_id=request.state.user.id, star=count)
+    await db.execute(query.on_conflict_do_update(
+        index_elements=[models.Review.user_id, models.Review.product_id],
+        set_={'star': count}
+    ))
+    await db.commit()
+    await purge('products', product_tag(product_id))
+    return RedirectResponse(url='/', status_code=HTTP_303_SEE_OTHER)
@@ -0,0 +1,11 @@
+from apps.search.base import SearchBackend
+from apps.search.memory import InvertedIndexSearch
+from apps.search.postgres import PostgresSearch
+from config import settings
+
+backends = {
+    'postgres': PostgresSearch,
+    'memory': InvertedIndexSearch,
+}
+
+search_backend: SearchBackend = backends[settings.SEARCH_BACKEND]()
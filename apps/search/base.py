@@ -0,0 +1,32 @@
+import re
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps.utils.pagination import Page
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value) -> list:
+    return TOKEN_RE.findall(str(value or '').lower())
+
+
+class SearchBackend:
+    """Ranked product search over name, description and specification values.
+
+    `search` returns a keyset `Page` of product ids ordered by relevance; loading the products
+    themselves is left to the caller so every backend shares the listing loader.
+    """
+
+    async def search(self, db: AsyncSession, query: str, cursor: Optional[str] = None, limit: int = 6) -> Page:
+        raise NotImplementedError
+
+    def index_product(self, product):
+        """Make a newly saved product searchable; a no-op where the database maintains the index."""
+
+    def remove_product(self, product_id: int):
+        """Forget a deleted product; a no-op where the database maintains the index."""
+
+    async def rebuild(self, db: AsyncSession):
+        """Reindex every product from the database; a no-op where the database maintains the index."""
@@ -0,0 +1,90 @@
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps import models
+from apps.search.base import SearchBackend, tokenize
+from apps.utils.pagination import Page, NEXT, PREV, decode_cursor, build_page
+
+FIELD_WEIGHTS = {'name': 1.0, 'description': 0.4, 'specifications': 0.2}
+
+
+def trigrams(token: str) -> set:
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: str, b: str) -> float:
+    """Trigram similarity with the same definition as pg_trgm's `similarity()`."""
+    left, right = trigrams(a), trigrams(b)
+    return len(left & right) / len(left | right) if left or right else 0.0
+
+
+class InvertedIndexSearch(SearchBackend):
+    """Pure-Python inverted index for running search without Postgres (tests, local development).
+
+    Query terms are matched exactly or, failing that, against vocabulary terms whose trigram similarity
+    reaches `threshold`; scores are the field weights of the matched terms scaled by that similarity.
+    """
+
+    def __init__(self, threshold: float = 0.3):
+        self.threshold = threshold
+        self._postings = defaultdict(dict)  # term -> {product_id: weight}
+        self._documents = {}  # product_id -> terms
+
+    def index_product(self, product):
+        self.remove_product(product.id)
+        weights = defaultdict(float)
+        fields = {
+            'name': product.name,
+            'description': product.description,
+            'specifications': ' '.join(map(str, (product.specifications or {}).values())),
+        }
+        for field, value in fields.items():
+            for term in tokenize(value):
+                weights[term] += FIELD_WEIGHTS[field]
+        for term, weight in weights.items():
+            self._postings[term][product.id] = weight
+        self._documents[product.id] = set(weights)
+
+    def remove_product(self, product_id: int):
+        for term in self._documents.pop(product_id, ()):
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+
+    async def rebuild(self, db: AsyncSession):
+        self._postings.clear()
+        self._documents.clear()
+        for product in await db.scalars(select(models.Product)):
+            self.index_product(product)
+
+    def _expand(self, term: str) -> dict:
+        if term in self._postings:
+            return {term: 1.0}
+        return {
+            candidate: score for candidate in self._postings
+            if (score := similarity(term, candidate)) >= self.threshold
+        }
+
+    def score(self, query: str) -> dict:
+        scores = defaultdict(float)
+        for term in tokenize(query):
+            for candidate, closeness in self._expand(term).items():
+                for product_id, weight in self._postings[candidate].items():
+                    scores[product_id] += weight * closeness
+        return scores
+
+    async def search(self, db: AsyncSession, query: str, cursor: Optional[str] = None, limit: int = 6) -> Page:
+        ranked = sorted(((score, pk) for pk, score in self.score(query).items()), reverse=True)
+        direction, values = decode_cursor(cursor, float, int)
+        if direction == NEXT:
+            ranked = [row for row in ranked if row < values]
+        elif direction == PREV:
+            ranked = [row for row in reversed(ranked) if row > values]
+
+        page = build_page(ranked[:limit + 1], direction, limit, lambda row: row)
+        return page._replace(items=[pk for _, pk in page.items])
@@ -0,0 +1,40 @@
+from typing import Optional
+
+from sqlalchemy import select, func, or_, tuple_, Float, cast
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps import models
+from apps.search.base import SearchBackend
+from apps.utils.pagination import Page, NEXT, PREV, decode_cursor, build_page
+
+
+class PostgresSearch(SearchBackend):
+    """Full-text search on the generated `product.search_vector` column (GIN) with pg_trgm typo tolerance on names.
+
+    Relevance is `ts_rank_cd` plus the trigram similarity of the name, so a misspelt "iphon" still finds "iPhone".
+    """
+
+    config = 'simple'
+
+    async def search(self, db: AsyncSession, query: str, cursor: Optional[str] = None, limit: int = 6) -> Page:
+        tsquery = func.websearch_to_tsquery(self.config, query)
+        rank = func.ts_rank_cd(models.Product.search_vector, tsquery)
+        score = cast(rank + func.similarity(models.Product.name, query), Float)
+        matches = select(models.Product.id, score.label('score')).where(or_(
+            models.Product.search_vector.op('@@')(tsquery),
+            models.Product.name.op('%')(query),
+        )).subquery()
+
+        key = tuple_(matches.c.score, matches.c.id)
+        stmt = select(matches.c.id, matches.c.score)
+        direction, values = decode_cursor(cursor, float, int)
+        if direction == NEXT:
+            stmt = stmt.where(key < tuple_(*values)).order_by(matches.c.score.desc(), matches.c.id.desc())
+        elif direction == PREV:
+            stmt = stmt.where(key > tuple_(*values)).order_by(matches.c.score.asc(), matches.c.id.asc())
+        else:
+            stmt = stmt.order_by(matches.c.score.desc(), matches.c.id.desc())
+
+        rows = (await db.execute(stmt.limit(limit + 1))).all()
+        page = build_page(rows, direction, limit, lambda row: (row.score, row.id))
+        return page._replace(items=[row.id for row in page.items])
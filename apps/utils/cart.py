@@ -0,0 +1,40 @@
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from apps import models
+from apps.utils.cache import TTLCache
+from config import settings
+
+cart_cache = TTLCache(maxsize=settings.CART_CACHE_SIZE, ttl=settings.CART_CACHE_TTL)
+
+
+class CartSummary(NamedTuple):
+    lines: int  # distinct products in the cart
+    items: int  # sum of quantities, shown on the header badge
+    amount: Decimal  # sum of the line prices
+
+
+EMPTY_CART = CartSummary(0, 0, Decimal(0))
+
+
+async def cart_summary(db: AsyncSession, user_id: Optional[int]) -> CartSummary:
+    """Totals of `user_id`'s cart, cached per worker process for CART_CACHE_TTL; anonymous users have an empty one."""
+    if user_id is None:
+        return EMPTY_CART
+    if (summary := cart_cache.get(user_id)) is not None:
+        return summary
+    query = select(
+        func.count(models.Card.id),
+        func.coalesce(func.sum(models.Card.total), 0),
+        func.coalesce(func.sum(models.Product.price), 0),
+    ).join(models.Card.product).where(models.Card.user_id == user_id)
+    summary = CartSummary(*(await db.execute(query)).one())
+    cart_cache.set(user_id, summary)
+    return summary
+
+
+def invalidate_cart(*user_ids):
+    cart_cache.pop(*user_ids)
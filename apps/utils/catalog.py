@@ -0,0 +1,172 @@
+from typing import Optional
+
+from sqlalchemy import select, delete, insert, func, text, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from apps import models
+from apps.utils.pagination import keyset_page, ApproximateCount
+from config import settings
+
+product_count = ApproximateCount(models.Product, ttl=settings.CATALOG_COUNT_TTL)
+
+SPEC_PREFIX = 'spec.'
+
+
+async def load_first_images(db: AsyncSession, product_ids) -> dict:
+    """{product_id: ProductImage} with the first uploaded image of every given product.
+
+    min(id) per product is read off the (product_id, id) index.
+    """
+    if not product_ids:
+        return {}
+    first = select(func.min(models.ProductImage.id)).where(models.ProductImage.product_id.in_(product_ids)) \
+        .group_by(models.ProductImage.product_id)
+    query = select(models.ProductImage).where(models.ProductImage.id.in_(first))
+    return {image.product_id: image for image in await db.scalars(query)}
+
+
+async def load_liked(db: AsyncSession, user_id: Optional[int], product_ids) -> set:
+    """Ids of the given products that `user_id` liked; served by the (user_id, product_id) unique index."""
+    if user_id is None or not product_ids:
+        return set()
+    query = select(models.Like.product_id).where(models.Like.user_id == user_id,
+                                                 models.Like.product_id.in_(product_ids))
+    return set(await db.scalars(query))
+
+
+async def load_products(db: AsyncSession, product_ids: list, user_id: Optional[int] = None):
+    """Products with the given ids in that order (e.g. ranked search hits), their first images and the ids
+    of those `user_id` liked."""
+    if not product_ids:
+        return [], {}, set()
+    query = select(models.Product).options(joinedload(models.Product.category)) \
+        .where(models.Product.id.in_(product_ids))
+    products = {product.id: product for product in await db.scalars(query)}
+    images = await load_first_images(db, list(products))
+    liked = await load_liked(db, user_id, list(products))
+    return [products[pk] for pk in product_ids if pk in products], images, liked
+
+
+async def load_product_page(db: AsyncSession, query, cursor: Optional[str] = None, limit: int = 6,
+                            user_id: Optional[int] = None):
+    """One keyset page of products with their category, their first images and the ids of those `user_id` liked.
+
+    Three queries no matter how many products, users, images or likes exist.
+    """
+    query = query.options(joinedload(models.Product.category))
+    page = await keyset_page(db, query, models.Product.id, cursor, limit)
+    product_ids = [product.id for product in page.items]
+    images = await load_first_images(db, product_ids)
+    liked = await load_liked(db, user_id, product_ids)
+    return page, images, liked
+
+
+async def category_facets(db: AsyncSession) -> list:
+    """(Category, product count) of every non-empty category, read from the trigger maintained counters."""
+    query = select(models.Category, models.CategoryCount.products).join(models.Category.count) \
+        .where(models.CategoryCount.products > 0).order_by(models.Category.name)
+    return (await db.execute(query)).all()
+
+
+def spec_filters(query_params) -> dict:
+    """{key: [values]} of the ``spec.<key>=<value>`` query parameters, e.g. ``?spec.Brand Name=Apple``."""
+    filters = {}
+    for name, value in query_params.multi_items():
+        if name.startswith(SPEC_PREFIX) and len(name) > len(SPEC_PREFIX) and value:
+            filters.setdefault(name[len(SPEC_PREFIX):], []).append(value)
+    return filters
+
+
+def filter_by_specs(query, filters: dict):
+    """Products having every key with one of its values, matched exactly.
+
+    Each value is a ``specifications @> '{"key": "value"}'`` containment, which the jsonb_path_ops GIN
+    index answers; values of one key are OR-ed, keys AND-ed.
+    """
+    for key, values in filters.items():
+        query = query.where(or_(*(models.Product.specifications.contains({key: value}) for value in values)))
+    return query
+
+
+def spec_params(filters: dict, key: Optional[str] = None, value: Optional[str] = None) -> dict:
+    """Query parameters of `filters`, with `value` of `key` toggled when given; for links in templates."""
+    filters = {name: list(values) for name, values in filters.items()}
+    if key is not None:
+        values = filters.setdefault(key, [])
+        if value in values:
+            values.remove(value)
+        else:
+            values.append(value)
+    return {SPEC_PREFIX + name: values for name, values in filters.items() if values}
+
+
+async def spec_facets(db: AsyncSession, limit: int = settings.SPEC_FACET_VALUES) -> dict:
+    """{key: [(value, product count)]} with the `limit` most common values of every specification key."""
+    facet = models.SpecFacet
+    rank = func.row_number().over(partition_by=facet.key, order_by=(facet.products.desc(), facet.value))
+    ranked = select(facet.key, facet.value, facet.products, rank.label('rank')) \
+        .where(facet.products > 0).subquery()
+    query = select(ranked.c.key, ranked.c.value, ranked.c.products).where(ranked.c.rank <= limit) \
+        .order_by(ranked.c.key, ranked.c.rank)
+    facets = {}
+    for key, value, products in await db.execute(query):
+        facets.setdefault(key, []).append((value, products))
+    return facets
+
+
+async def rebuild_counters(db: AsyncSession):
+    """(Re)install the counter triggers, then recount the counter tables, product ratings and likes from scratch,
+    e.g. for data older than the triggers.
+
+    Product, review and like writes wait until the transaction commits, so no change slips between count and swap.
+    """
+    await db.run_sync(lambda session: models.install_counters(session.connection()))
+    await db.execute(text('LOCK TABLE product, review, "like" IN SHARE MODE'))
+    await db.execute(delete(models.CategoryCount))
+    await db.execute(insert(models.CategoryCount).from_select(
+        ['category_id', 'products'],
+        select(models.Category.id, func.count(models.Product.id))
+        .outerjoin(models.Category.products).group_by(models.Category.id)
+    ))
+    await db.execute(delete(models.SpecFacet))
+    await db.execute(text(
+        "INSERT INTO specfacet (key, value, products) SELECT spec.key, spec.value #>> '{}', count(*) "
+        "FROM product CROSS JOIN LATERAL jsonb_each(product.specifications) spec "
+        "WHERE jsonb_typeof(spec.value) = 'string' GROUP BY 1, 2"
+    ))
+    await db.execute(text(
+        'UPDATE product SET rating_count = totals.count, rating_sum = totals.sum, rating_1 = totals.r1, '
+        'rating_2 = totals.r2, rating_3 = totals.r3, rating_4 = totals.r4, rating_5 = totals.r5 '
+        'FROM ('
+        '   SELECT product.id, count(review.star) AS count, coalesce(sum(review.star), 0) AS sum, '
+        '       count(*) FILTER (WHERE review.star = 1) AS r1, count(*) FILTER (WHERE review.star = 2) AS r2, '
+        '       count(*) FILTER (WHERE review.star = 3) AS r3, count(*) FILTER (WHERE review.star = 4) AS r4, '
+        '       count(*) FILTER (WHERE review.star = 5) AS r5 '
+        '   FROM product LEFT JOIN review ON review.product_id = product.id AND review.star BETWEEN 1 AND 5 '
+        '   GROUP BY product.id'
+        ') totals '
+        'WHERE product.id = totals.id AND (product.rating_count, product.rating_sum, product.rating_1, '
+        'product.rating_2, product.rating_3, product.rating_4, product.rating_5) IS DISTINCT FROM '
+        '(totals.count, totals.sum, totals.r1, totals.r2, totals.r3, totals.r4, totals.r5)'
+    ))
+    await db.execute(text(
+        'UPDATE product SET like_count = totals.likes '
+        'FROM (SELECT product.id, count("like".id) AS likes FROM product '
+        '      LEFT JOIN "like" ON "like".product_id = product.id GROUP BY product.id) totals '
+        'WHERE product.id = totals.id AND product.like_count <> totals.likes'
+    ))
+    await db.commit()
+
+
+if __name__ == '__main__':
+    import asyncio
+
+    from database import Session, engine
+
+    async def main():
+        async with Session() as db:
+            await rebuild_counters(db)
+        await engine.dispose()
+
+    asyncio.run(main())
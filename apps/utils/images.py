@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from apps import models
+from apps.utils.jobs import job
+from apps.utils.page_cache import purge, product_tag
+from config import settings, templates
+from database import Session
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box the variant is scaled down into
+SIZES = {
+    'card': (400, 400),
+    'detail': (900, 900),
+    'zoom': (1800, 1800),
+}
+# format -> (Pillow format, extension, save options)
+FORMATS = {
+    'jpeg': ('JPEG', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+}
+PLACEHOLDER = '/static/assets/img/products/2.jpg'
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def render_variants(path: str) -> dict:
+    """Write every size/format derivative of the image at `path` next to it; runs in a worker process.
+
+    Originals are content-addressed, so a derivative that already exists is reused as is.
+    """
+    from PIL import Image, ImageOps
+
+    base = os.path.splitext(path)[0]
+    variants = {}
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+        for name, box in SIZES.items():
+            resized = image.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+            variants[name] = {}
+            for fmt, (pil_format, extension, options) in FORMATS.items():
+                target = f'{base}_{name}{extension}'
+                if not os.path.exists(target):
+                    resized.save(target, pil_format, **options)
+                variants[name][fmt] = target
+    return variants
+
+
+@job('images.variants')
+async def build_image_variants(image_ids: list):
+    """Generate derivatives for the given ProductImage rows in the process pool and record them on the rows.
+
+    Each image is committed and its product page purged as soon as it is done, so one bad or slow file does not
+    hold back the others; files Pillow cannot read are logged and left without variants.
+    """
+    from PIL import UnidentifiedImageError
+
+    loop = asyncio.get_running_loop()
+    async with Session() as db:
+        query = select(models.ProductImage.id, models.ProductImage.image, models.ProductImage.product_id) \
+            .where(models.ProductImage.id.in_(image_ids))
+        rows = (await db.execute(query)).all()
+        await db.commit()  # no transaction stays open while the pool renders
+        stored = False
+        for pk, path, product_id in rows:
+            try:
+                variants = await loop.run_in_executor(get_executor(), render_variants, path)
+            except UnidentifiedImageError as exc:
+                logger.warning('image %d (%s) skipped: %s', pk, path, exc)
+                continue
+            await db.execute(update(models.ProductImage).where(models.ProductImage.id == pk).values(variants=variants))
+            await db.commit()
+            # runs in worker.py: reaches the web processes through the shared file backend only (see config.py)
+            await purge(product_tag(product_id))
+            stored = True
+    if stored:
+        await purge('products')
+
+
+def image_url(image, size: str = 'card', fmt: str = 'jpeg') -> str:
+    """URL of the best available rendition of a ProductImage: the variant, else the original, else a placeholder."""
+    if image is None:
+        return PLACEHOLDER
+    path = ((image.variants or {}).get(size) or {}).get(fmt)
+    if path is None:
+        return '/' + image.image if fmt == 'jpeg' else ''
+    return '/' + path
+
+
+templates.env.globals['image_url'] = image_url
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import select, update, or_, and_, func, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session as SyncSession
+
+import database
+from apps import models
+from database import seconds_from_now
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+registry: dict[str, Callable] = {}
+periodic: dict[str, float] = {}  # name -> interval in seconds
+_inserts = set()  # jobs of committed transactions still being written to JOB_DATABASE_URL
+
+if settings.JOB_DATABASE_URL:
+    engine = create_async_engine(settings.JOB_DATABASE_URL)
+    Session = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+else:
+    engine, Session = database.engine, database.Session
+
+
+def job(name: str, every: Optional[float] = None):
+    """Register an async function as job `name`; with `every` the worker also runs it every `every` seconds."""
+
+    def decorator(func):
+        registry[name] = func
+        if every:
+            periodic[name] = every
+        return func
+
+    return decorator
+
+
+async def enqueue(db: Optional[AsyncSession], name: str, payload: dict = None, delay: float = None,
+                  max_attempts: int = None) -> models.Job:
+    """Queue ``name(**payload)`` to run `delay` seconds from now by the job database's clock (default: now).
+
+    When jobs live in the main database the row joins `db`'s transaction, so the job exists exactly when
+    the caller's changes do. With a separate JOB_DATABASE_URL it is written once `db` commits and dropped if it
+    rolls back, so a worker never picks up a job before the rows it refers to are visible; a crash right
+    between the two commits loses the job. Without `db` it is committed right away.
+    """
+    row = models.Job(
+        name=name,
+        payload=payload or {},
+        run_at=seconds_from_now(float(delay)) if delay else func.now(),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS
+    )
+    if db is not None and Session is database.Session:
+        db.add(row)
+    elif db is not None:
+        if not db.in_transaction():
+            await db.begin()  # so that a rollback before any statement drops the job too
+        db.info.setdefault('jobs', []).append(row)
+    else:
+        await _insert_jobs([row])
+    return row
+
+
+async def _insert_jobs(rows: list):
+    async with Session() as job_db:
+        job_db.add_all(rows)
+        await job_db.commit()
+
+
+async def _insert_committed_jobs(rows: list):
+    try:
+        await _insert_jobs(rows)
+    except Exception:
+        logger.exception('jobs: could not queue %s after commit', ', '.join(row.name for row in rows))
+
+
+@event.listens_for(SyncSession, 'after_commit')
+def _queue_after_commit(session):
+    if rows := session.info.pop('jobs', None):
+        task = asyncio.get_running_loop().create_task(_insert_committed_jobs(rows))
+        _inserts.add(task)
+        task.add_done_callback(_inserts.discard)
+
+
+@event.listens_for(SyncSession, 'after_rollback')
+def _drop_after_rollback(session):
+    session.info.pop('jobs', None)
+
+
+async def create_tables():
+    """Create the job table in a separate SQLite JOB_DATABASE_URL; the main database gets it with the others."""
+    if engine.dialect.name == 'sqlite':
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Job.__table__.create, checkfirst=True)
+
+
+async def job_status(db: AsyncSession) -> list:
+    """(name, status, count, oldest run_at) for every job name and status in the table."""
+    query = select(models.Job.name, models.Job.status, func.count(), func.min(models.Job.run_at)) \
+        .group_by(models.Job.name, models.Job.status).order_by(models.Job.name, models.Job.status)
+    return (await db.execute(query)).all()
+
+
+class JobWorker:
+    """Claims due jobs and runs up to `concurrency` of them at once.
+
+    Claiming is one ``UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING``, so any number
+    of workers can share the table; SQLite has no row locks but serialises the write instead. A job still
+    running after `timeout` is cancelled, and one whose worker died is picked up again once its lock is older
+    than that, or marked failed if that was its last attempt. Failures are retried after
+    ``backoff * 2 ** (attempts - 1)`` seconds until `max_attempts`.
+    """
+
+    def __init__(self, concurrency=4, poll_interval=1.0, timeout=300, backoff=10):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.backoff = backoff
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self._tasks = set()
+        self._stopping = False
+
+    async def claim(self, limit: int) -> list:
+        stale = and_(models.Job.status == 'running', models.Job.locked_at < seconds_from_now(-float(self.timeout)))
+        due = select(models.Job.id).where(or_(
+            and_(models.Job.status == 'queued', models.Job.run_at <= func.now()),
+            and_(stale, models.Job.attempts < models.Job.max_attempts),
+        )).order_by(models.Job.run_at).limit(limit).with_for_update(skip_locked=True)
+        query = update(models.Job).where(models.Job.id.in_(due)).values(
+            status='running',
+            locked_at=func.now(),
+            attempts=models.Job.attempts + 1
+        ).returning(models.Job)
+        async with Session() as db:
+            # their worker died during the last attempt
+            abandoned = await db.execute(
+                update(models.Job).where(stale, models.Job.attempts >= models.Job.max_attempts)
+                .values(status='failed', finished_at=func.now(), last_error='worker died or timed out')
+            )
+            self.failed += abandoned.rowcount
+            rows = (await db.scalars(query, execution_options={'synchronize_session': False})).all()
+            await db.commit()
+        return rows
+
+    async def execute(self, row: models.Job):
+        started = time.perf_counter()
+        try:
+            handler = registry.get(row.name)
+            if handler is None:
+                raise LookupError(f'no job registered as {row.name!r}')
+            await asyncio.wait_for(handler(**row.payload), self.timeout)
+        except Exception as exc:
+            values = {'last_error': repr(exc)}
+            if row.attempts >= row.max_attempts:
+                values.update(status='failed', finished_at=func.now())
+                self.failed += 1
+            else:
+                delay = float(self.backoff * 2 ** (row.attempts - 1))
+                values.update(status='queued', run_at=seconds_from_now(delay))
+                self.retried += 1
+            logger.warning('job %s #%d attempt %d failed: %r', row.name, row.id, row.attempts, exc)
+        else:
+            values = {'status': 'done', 'finished_at': func.now(), 'last_error': None}
+            self.done += 1
+            logger.info('job %s #%d done in %.0f ms', row.name, row.id, (time.perf_counter() - started) * 1000)
+
+        async with Session() as db:
+            await db.execute(update(models.Job).where(models.Job.id == row.id).values(**values))
+            await db.commit()
+        if row.name in periodic and values['status'] != 'queued':
+            await enqueue(None, row.name, row.payload, delay=periodic[row.name])
+
+    async def schedule_periodic(self):
+        """Queue one run of every periodic job that has none queued or running yet."""
+        async with Session() as db:
+            query = select(models.Job.name).where(
+                models.Job.name.in_(periodic),
+                models.Job.status.in_(('queued', 'running'))
+            )
+            active = set(await db.scalars(query))
+        for name in periodic.keys() - active:
+            await enqueue(None, name)
+
+    async def run(self):
+        await self.schedule_periodic()
+        while not self._stopping:
+            free = self.concurrency - len(self._tasks)
+            rows = await self.claim(free) if free else []
+            for row in rows:
+                task = asyncio.create_task(self.execute(row))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if free and len(rows) == free:
+                continue
+            if self._tasks:
+                await asyncio.wait(self._tasks, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(self.poll_interval)
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+
+    def stop(self):
+        """Stop claiming; `run` returns once the jobs in flight have finished."""
+        self._stopping = True
+
+    def stats(self) -> dict:
+        return {'running': len(self._tasks), 'done': self.done, 'retried': self.retried, 'failed': self.failed}
@@ -0,0 +1,222 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from apps.hashing import hashing_pool
+from apps.utils import page_cache
+from apps.utils.cache import user_cache
+from apps.utils.cart import cart_cache
+from apps.utils.profiling import current_stats, instrument_engine, start_request_stats, route_name
+from apps.utils.templating import fragment_cache
+from database import MonitoredPool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = (
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    )
+    return '{%s}' % ','.join(pairs)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = defaultdict(float)
+
+    def inc(self, *labels, value: float = 1):
+        self.values[labels] += value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name + _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, value: float = 1):
+        self.values[labels] -= value
+
+
+class Collected:
+    """A metric read at scrape time: `read()` returns {labels: value}, e.g. from counters an object keeps itself."""
+
+    def __init__(self, name: str, documentation: str, read, labels: tuple = (), kind: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.labels = labels
+        self.kind = kind
+
+    def samples(self):
+        for labels, value in self.read().items():
+            yield self.name + _labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [count per bucket (+Inf last), sum]
+
+    def observe(self, value: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(names, labels + (bound,)), cumulative
+            yield self.name + '_sum' + _labels(self.labels, labels), total
+            yield self.name + '_count' + _labels(self.labels, labels), cumulative
+
+
+requests_total = Counter('http_requests_total', 'Requests handled.', ('route', 'method', 'status'))
+request_seconds = Histogram('http_request_duration_seconds', 'Time to the last response byte.', ('route',))
+in_flight = Gauge('http_requests_in_flight', 'Requests being handled right now.')
+render_seconds = Histogram('template_render_seconds', 'Jinja template render time.', ('template',))
+route_render_seconds = Counter('http_render_seconds_total', 'Template render time spent per route.', ('route',))
+route_queries = Histogram('db_queries_per_request', 'SQL statements executed per request.', ('route',),
+                          buckets=QUERY_BUCKETS)
+route_db_seconds = Counter('db_query_seconds_total', 'Time spent executing SQL per route.', ('route',))
+pool_wait_seconds = Histogram('db_pool_checkout_seconds', 'Wait for a pooled connection (incl. connecting).')
+route_pool_wait_seconds = Counter('db_pool_wait_seconds_total', 'Pool checkout wait per route.', ('route',))
+
+caches = {'user': user_cache, 'cart': cart_cache, 'fragment': fragment_cache}  # TTLCaches by name, this process only
+
+
+def _cache_stat(key: str):
+    return lambda: {(name,): cache.stats()[key] for name, cache in caches.items()}
+
+
+cache_hits = Collected('cache_hits_total', 'In-process cache hits.', _cache_stat('hits'), ('cache',), 'counter')
+cache_misses = Collected('cache_misses_total', 'In-process cache misses, expired entries included.',
+                         _cache_stat('misses'), ('cache',), 'counter')
+cache_evictions = Collected('cache_evictions_total', 'Entries dropped to stay within the cache size.',
+                            _cache_stat('evictions'), ('cache',), 'counter')
+cache_entries = Collected('cache_entries', 'Entries in the cache, expired ones included.', _cache_stat('size'),
+                          ('cache',))
+page_cache_hits = Collected('page_cache_hits_total', 'Cacheable GETs served from the page cache.',
+                            lambda: {(): page_cache.stats['hits']}, kind='counter')
+page_cache_misses = Collected('page_cache_misses_total', 'GETs with no fresh page cache entry, cacheable or not.',
+                              lambda: {(): page_cache.stats['misses']}, kind='counter')
+page_cache_purges = Collected('page_cache_purges_total', 'Page cache purges from this process.',
+                              lambda: {(): page_cache.stats['purges']}, kind='counter')
+hash_queued = Collected('hash_pool_queued', 'Password hashes accepted and waiting for a thread.',
+                        lambda: {(): hashing_pool.stats()['queued']})
+hash_wait_seconds = Collected('hash_pool_wait_seconds_total', 'Time password hashes waited for a thread.',
+                              lambda: {(): hashing_pool.wait_seconds}, kind='counter')
+hash_rejected = Collected('hash_pool_rejected_total', 'Password hashes turned away with a 503.',
+                          lambda: {(): hashing_pool.rejected}, kind='counter')
+
+registry = [
+    requests_total, request_seconds, in_flight, render_seconds, route_render_seconds,
+    route_queries, route_db_seconds, pool_wait_seconds, route_pool_wait_seconds,
+    cache_hits, cache_misses, cache_evictions, cache_entries, page_cache_hits, page_cache_misses, page_cache_purges,
+    hash_queued, hash_wait_seconds, hash_rejected,
+]
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{sample} {value}' for sample, value in metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def observe_pool_wait(waited: float):
+    pool_wait_seconds.observe(waited)
+    if (stats := current_stats.get()) is not None:
+        stats.pool_wait += waited
+
+
+class MetricsMiddleware:
+    """Records latency, status, SQL, pool wait and render time of every request under its route name."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats, token = start_request_stats()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            if token is not None:
+                current_stats.reset(token)
+            route = route_name(scope)
+            requests_total.inc(route, scope['method'], status_code)
+            request_seconds.observe(elapsed, route)
+            route_queries.observe(stats.queries, route)
+            route_db_seconds.inc(route, value=stats.db_time)
+            route_pool_wait_seconds.inc(route, value=stats.pool_wait)
+            route_render_seconds.inc(route, value=stats.render_time)
+
+
+def instrument_templates(templates):
+    """Time every ``templates.TemplateResponse``, which is where Jinja renders."""
+    template_response = templates.TemplateResponse
+
+    def timed_template_response(name, *args, **kwargs):
+        started = time.perf_counter()
+        response = template_response(name, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        render_seconds.observe(elapsed, name)
+        if (stats := current_stats.get()) is not None:
+            stats.render_time += elapsed
+        return response
+
+    templates.TemplateResponse = timed_template_response
+
+
+def install_metrics(app, engines: list, templates):
+    """Hook everything up and serve ``GET /metrics``; nothing here runs unless METRICS_ENABLED is set."""
+    for engine in engines:
+        instrument_engine(engine)
+    instrument_templates(templates)
+    MonitoredPool.observers.append(observe_pool_wait)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get('/metrics', include_in_schema=False)
+    def metrics():
+        return Response(render_metrics(), media_type='text/plain; version=0.0.4')  # Starlette appends the charset
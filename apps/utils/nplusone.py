@@ -0,0 +1,134 @@
+import logging
+import os
+import sys
+from contextvars import ContextVar
+from typing import Optional
+
+import greenlet
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from apps.utils.profiling import route_name
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# The standard library, installed packages and this module are plumbing; the origin of a query is the
+# first frame outside them.
+_SKIP = (os.path.dirname(os.__file__), __file__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestQueries:
+    __slots__ = ('total', 'statements', 'lazy_loads', 'reported')
+
+    def __init__(self):
+        self.total = 0
+        self.statements = {}  # SQL text -> executions
+        self.lazy_loads = {}  # 'Model.relationship' -> lazy loads
+        self.reported = set()
+
+
+current_queries: ContextVar[Optional[RequestQueries]] = ContextVar('current_queries', default=None)
+
+
+def _frames():
+    """Current stack, continuing into the greenlet SQLAlchemy's asyncio layer switched from."""
+    frame = sys._getframe(2)
+    current = greenlet.getcurrent()
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+        if frame is None and current.parent is not None:
+            current = current.parent
+            frame = current.gr_frame
+
+
+def origin() -> str:
+    """``template.html:line`` or ``file.py:line in function`` of the code that triggered the current query."""
+    for frame in _frames():
+        filename = frame.f_code.co_filename
+        if filename.endswith('.html'):
+            # Jinja keeps "template line=code line" pairs of the compiled module in `debug_info`
+            pairs = [pair.split('=') for pair in (frame.f_globals.get('debug_info') or '').split('&') if pair]
+            lineno = next((int(template_line) for template_line, code_line in reversed(pairs)
+                           if int(code_line) <= frame.f_lineno), frame.f_lineno)
+            return f'{os.path.relpath(filename)}:{lineno}'
+        if not filename.startswith(_SKIP) and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename)}:{frame.f_lineno} in {frame.f_code.co_name}'
+    return 'unknown'
+
+
+def report(message: str):
+    if settings.NPLUSONE_MODE == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = current_queries.get()
+    if queries is None:
+        return
+    queries.total += 1
+    count = queries.statements[statement] = queries.statements.get(statement, 0) + 1
+    if count == settings.NPLUSONE_THRESHOLD and statement not in queries.reported:
+        queries.reported.add(statement)
+        report(f'N+1: the same statement ran {count} times in one request, from {origin()}: '
+               f'{" ".join(statement.split())[:200]}')
+
+
+def _do_orm_execute(orm_execute_state):
+    queries = current_queries.get()
+    if queries is None or orm_execute_state.lazy_loaded_from is None:
+        return
+    relationship = str(orm_execute_state.loader_strategy_path.path[-1])
+    count = queries.lazy_loads[relationship] = queries.lazy_loads.get(relationship, 0) + 1
+    if count == settings.NPLUSONE_THRESHOLD and relationship not in queries.reported:
+        queries.reported.add(relationship)
+        report(f'N+1: {relationship} was lazy loaded {count} times in one request, from {origin()}; '
+               f'eager load it with selectinload/joinedload')
+
+
+class QueryBudgetMiddleware:
+    """Tracks the statements of every request; see `install_nplusone`."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        queries = RequestQueries()
+        token = current_queries.set(queries)
+
+        async def send_checked(message):
+            if message['type'] == 'http.response.start':
+                route = route_name(scope)
+                budget = settings.QUERY_BUDGETS.get(route, settings.QUERY_BUDGET)
+                if queries.total > budget:
+                    report(f'{route} ran {queries.total} queries, over its budget of {budget}')
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_checked)
+        finally:
+            current_queries.reset(token)
+
+
+def install_nplusone(app, engines: list):
+    """Development/test aid, enabled by NPLUSONE_MODE=log|raise.
+
+    Reports a statement that runs NPLUSONE_THRESHOLD times in one request, a relationship lazy loaded that
+    often, and a route exceeding its query budget (QUERY_BUDGETS, else QUERY_BUDGET), with the originating
+    code or template line. ``raise`` turns every report into QueryBudgetExceeded, failing the request and
+    so the test that made it.
+    """
+    for engine in engines:
+        event.listen(getattr(engine, 'sync_engine', engine), 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Session, 'do_orm_execute', _do_orm_execute)
+    app.add_middleware(QueryBudgetMiddleware)
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import smtplib
+import time
+from collections import deque
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from apps import models
+from config import settings
+from database import Session, seconds_from_now
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(db: AsyncSession, recipient: str, subject: str, html: str) -> models.Outbox:
+    """Add a message to the outbox; it is sent once the caller's transaction commits."""
+    message = models.Outbox(recipient=recipient, subject=subject, html=html)
+    db.add(message)
+    return message
+
+
+def build_message(row: models.Outbox) -> MIMEMultipart:
+    message = MIMEMultipart()
+    message['Subject'] = row.subject
+    message['From'] = settings.SMTP_EMAIL
+    message['To'] = row.recipient
+    message.attach(MIMEText(row.html, 'html'))
+    return message
+
+
+class SMTPConnection:
+    """One logged-in SMTP session reused across messages.
+
+    Reconnects when the server has dropped the session or it sat idle longer than `idle_timeout`,
+    so the TLS handshake and login are paid once per burst rather than once per email.
+    """
+
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, timeout=30, idle_timeout=60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        server = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        self.connects += 1
+        return server
+
+    def send(self, message):
+        self.close_if_idle()
+        for retry in (False, True):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(message)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if retry:
+                    raise
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+class OutboxWorker:
+    """Drains the outbox in batches over one reused SMTP connection.
+
+    A batch is claimed in one short ``UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)``, which marks
+    its rows as sending, so several workers can drain the same table; the outcome of every message is committed
+    on its own. A message whose worker died while sending is claimed again once its `lease` runs out, so it may be
+    sent twice but is never lost. At most `rate` messages are sent per second. A failed message is retried after
+    ``backoff * 2 ** (attempts - 1)`` seconds (capped at `backoff_max`) and marked failed after `max_attempts`.
+    Due times come from the database clock.
+    """
+
+    def __init__(self, connection: SMTPConnection, batch_size=50, rate=10.0, max_attempts=8,
+                 backoff=30, backoff_max=3600, poll_interval=5, lease=600):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.interval = 1 / rate if rate else 0
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)  # seconds per send, most recent
+        self._last_send = 0.0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _pace(self):
+        delay = self._last_send + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_send = time.monotonic()
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(self.backoff * 2 ** (attempts - 1), self.backoff_max)
+
+    async def claim(self) -> list:
+        """Mark up to `batch_size` due messages as sending, counting the attempt, and return them."""
+        due = models.Outbox.status.in_(('pending', 'sending')) & (models.Outbox.next_attempt_at <= func.now())
+        ids = select(models.Outbox.id).where(due, models.Outbox.attempts < self.max_attempts) \
+            .order_by(models.Outbox.id).limit(self.batch_size).with_for_update(skip_locked=True)
+        query = update(models.Outbox).where(models.Outbox.id.in_(ids)).values(
+            status='sending',
+            attempts=models.Outbox.attempts + 1,
+            next_attempt_at=seconds_from_now(float(self.lease))
+        ).returning(models.Outbox)
+        async with Session() as db:
+            # lost while sending on their last attempt
+            abandoned = await db.execute(update(models.Outbox).where(
+                due, models.Outbox.status == 'sending', models.Outbox.attempts >= self.max_attempts
+            ).values(status='failed', last_error='worker stopped while sending'))
+            self.failed += abandoned.rowcount
+            rows = (await db.scalars(query, execution_options={'synchronize_session': False})).all()
+            await db.commit()
+        return sorted(rows, key=lambda row: row.id)
+
+    async def _record(self, row: models.Outbox, **values):
+        async with Session() as db:
+            await db.execute(update(models.Outbox).where(models.Outbox.id == row.id).values(**values))
+            await db.commit()
+
+    async def drain_once(self) -> int:
+        """Send one batch of due messages; returns how many were picked up."""
+        rows = await self.claim()
+        started = time.perf_counter()
+        for row in rows:
+            await self._pace()
+            send_started = time.perf_counter()
+            try:
+                await run_in_threadpool(self.connection.send, build_message(row))
+            except (smtplib.SMTPException, OSError) as exc:
+                if row.attempts >= self.max_attempts:
+                    await self._record(row, status='failed', last_error=repr(exc))
+                    self.failed += 1
+                else:
+                    await self._record(row, status='pending', last_error=repr(exc),
+                                       next_attempt_at=seconds_from_now(float(self._retry_delay(row.attempts))))
+                    self.retried += 1
+                if not isinstance(exc, smtplib.SMTPRecipientsRefused):
+                    await run_in_threadpool(self.connection.close)
+            else:
+                self.latencies.append(time.perf_counter() - send_started)
+                await self._record(row, status='sent', sent_at=func.now())
+                self.sent += 1
+        if rows:
+            logger.info('outbox: %d messages in %.0f ms, %s', len(rows), (time.perf_counter() - started) * 1000,
+                        self.stats())
+        return len(rows)
+
+    def wake(self):
+        """Start draining now instead of at the next poll, e.g. right after enqueueing a message."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                picked = await self.drain_once()
+            except Exception:
+                logger.exception('outbox: drain failed')
+                picked = 0
+            if picked < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await run_in_threadpool(self.connection.close_if_idle)
+                self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await run_in_threadpool(self.connection.close)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'connects': self.connection.connects,
+            'latency_ms_p50': percentile(0.50),
+            'latency_ms_p95': percentile(0.95),
+            'latency_ms_max': percentile(1),
+        }
+
+
+outbox = OutboxWorker(
+    SMTPConnection(
+        settings.SMTP_HOST, settings.SMTP_PORT, settings.SMTP_EMAIL, settings.SMTP_PASSWORD,
+        use_ssl=settings.SMTP_USE_SSL, timeout=settings.SMTP_TIMEOUT, idle_timeout=settings.SMTP_IDLE_TIMEOUT
+    ),
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    rate=settings.OUTBOX_RATE_LIMIT,
+    max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    backoff=settings.OUTBOX_RETRY_BACKOFF,
+    backoff_max=settings.OUTBOX_RETRY_BACKOFF_MAX,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL,
+)
+
+
+if __name__ == '__main__':
+    # Drain everything that is due and exit, e.g. against `python -m aiosmtpd -n -l localhost:8025`
+    # with SMTP_HOST=localhost SMTP_PORT=8025 SMTP_USE_SSL=0.
+    async def drain():
+        while await outbox.drain_once() == outbox.batch_size:
+            pass
+        await outbox.stop()
+        print(outbox.stats())
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(drain())
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import Response
+
+from apps.utils.replicas import current_routing
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+stats = {'hits': 0, 'misses': 0, 'purges': 0}  # this process only, served on /metrics
+
+
+class MemoryBackend:
+    """Per-process cache; purges only reach the worker they run in."""
+
+    def __init__(self, maxsize: int = 2000):
+        self.maxsize = maxsize
+        self._entries = {}
+        self._tags = {}
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, entry: dict):
+        if len(self._entries) >= self.maxsize:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = entry
+
+    async def tag_versions(self, tags) -> dict:
+        return {tag: self._tags.get(tag, 0) for tag in tags}
+
+    async def purge(self, *tags):
+        version = time.time_ns()
+        for tag in tags:
+            self._tags[tag] = version
+
+
+class FileBackend:
+    """Cache shared by every worker on the host through a directory; purges are visible to all of them.
+
+    Expired files are swept at most once per `ttl` by whichever worker stores an entry next.
+    """
+
+    def __init__(self, directory: str, ttl: int = None):
+        self.directory = directory
+        self.ttl = ttl or settings.PAGE_CACHE_TTL
+        self._next_sweep = time.monotonic() + self.ttl
+        os.makedirs(os.path.join(directory, 'tags'), exist_ok=True)
+
+    def _path(self, kind: str, key: str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, kind, digest[:2], digest)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _get(self, key: str):
+        data = self._read(self._path('entries', key))
+        if data is None:
+            return None
+        meta, body = data.split(b'\n', 1)
+        entry = json.loads(meta)
+        entry['body'] = body
+        return entry
+
+    def _set(self, key: str, entry: dict):
+        meta = json.dumps({name: value for name, value in entry.items() if name != 'body'}).encode('utf-8')
+        self._write(self._path('entries', key), meta + b'\n' + entry['body'])
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.ttl
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete entries written more than `ttl` ago, which have expired, and tag versions older than twice that.
+
+        A tag can only invalidate entries whose render started before its purge, and those expire within `ttl`
+        of being stored; the second `ttl` covers renders that were still running when the purge happened.
+        """
+        now = time.time()
+        removed = 0
+        for kind, max_age in (('entries', self.ttl), ('tags', 2 * self.ttl)):
+            for root, _, files in os.walk(os.path.join(self.directory, kind)):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        if now - os.stat(path).st_mtime > max_age:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass  # swept by another worker
+        if removed:
+            logger.info('page cache: swept %d files from %s', removed, self.directory)
+        return removed
+
+    def _tag_versions(self, tags) -> dict:
+        return {tag: int(self._read(self._path('tags', tag)) or 0) for tag in tags}
+
+    def _purge(self, *tags):
+        version = str(time.time_ns()).encode('utf-8')
+        for tag in tags:
+            self._write(self._path('tags', tag), version)
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key: str, entry: dict):
+        await run_in_threadpool(self._set, key, entry)
+
+    async def tag_versions(self, tags) -> dict:
+        return await run_in_threadpool(self._tag_versions, tags)
+
+    async def purge(self, *tags):
+        await run_in_threadpool(self._purge, *tags)
+
+
+def _make_backend():
+    if settings.PAGE_CACHE_BACKEND == 'file':
+        return FileBackend(settings.PAGE_CACHE_DIR)
+    if settings.PAGE_CACHE_ENABLED:
+        # purges from worker.py (e.g. new image variants) and from the other web workers never reach this one
+        logger.warning('page cache: the memory backend serves pages purged by worker.py or other workers until '
+                       'PAGE_CACHE_TTL runs out; use PAGE_CACHE_BACKEND=file')
+    return MemoryBackend()
+
+
+backend = _make_backend()
+
+
+def cache_page(request: Request, *tags):
+    """Mark the current GET response as cacheable, invalidated when any of `tags` is purged."""
+    request.state.cache_tags = set(tags)
+
+
+async def purge(*tags):
+    stats['purges'] += 1
+    await backend.purge(*tags)
+
+
+def product_tag(pk) -> str:
+    return f'product:{pk}'
+
+
+def category_tag(pk) -> str:
+    return f'category:{pk}'
+
+
+class PageCacheMiddleware(BaseHTTPMiddleware):
+    """Serves whole GET responses of routes that called `cache_page` from `backend`.
+
+    Only anonymous visitors are served from the cache: pages embed the signed-in user's header, cart
+    badge and forms. Responses that set a cookie are never stored. An entry is stale once its ttl runs
+    out or any of its tags has been purged since its render started. Pages read from a replica are not
+    stored: they may predate a purge that already happened on the primary.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        if not settings.PAGE_CACHE_ENABLED or request.method != 'GET' or getattr(request.state, 'user', None):
+            return await call_next(request)
+
+        query = '&'.join(sorted(f'{key}={value}' for key, value in request.query_params.multi_items()))
+        key = f'{request.url.path}?{query}'
+
+        entry = await backend.get(key)
+        if entry is not None and entry['expires'] > time.time() \
+                and max((await backend.tag_versions(entry['tags'])).values()) < entry['rendered']:
+            stats['hits'] += 1
+            return Response(entry['body'], entry['status'], headers={**entry['headers'], 'x-cache': 'HIT'})
+
+        stats['misses'] += 1
+        rendered = time.time_ns()
+        response = await call_next(request)
+        tags = getattr(request.state, 'cache_tags', None)
+        if not tags or response.status_code != 200 or 'set-cookie' in response.headers:
+            return response
+        if (routing := current_routing.get()) is not None and routing.replica_read:
+            return response
+
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        headers = {name: value for name, value in response.headers.items() if name != 'content-length'}
+        await backend.set(key, {
+            'status': response.status_code,
+            'headers': headers,
+            'body': body,
+            'tags': sorted(tags),
+            'rendered': rendered,
+            'expires': time.time() + settings.PAGE_CACHE_TTL,
+        })
+        return Response(body, response.status_code, headers={**headers, 'x-cache': 'MISS'})
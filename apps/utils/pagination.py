@@ -0,0 +1,112 @@
+import base64
+import binascii
+import math
+from time import monotonic
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+NEXT = 'n'
+PREV = 'p'
+INT_MAX = 2 ** 31 - 1  # cursors resume from Integer ids
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(direction: str, *values) -> str:
+    raw = ':'.join([direction, *map(str, values)])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def _in_range(value) -> bool:
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return not isinstance(value, int) or -INT_MAX - 1 <= value <= INT_MAX
+
+
+def decode_cursor(cursor: Optional[str], *types):
+    """(direction, values) of an opaque cursor, or (None, None) for a missing one; a tampered one is a 400.
+
+    `types` converts each encoded value back, e.g. ``decode_cursor(cursor, float, int)``.
+    """
+    if not cursor:
+        return None, None
+    try:
+        direction, *values = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8').split(':')
+        if direction in (NEXT, PREV) and len(values) == len(types):
+            values = tuple(convert(value) for convert, value in zip(types, values))
+            if all(map(_in_range, values)):
+                return direction, values
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        pass
+    raise HTTPException(status.HTTP_400_BAD_REQUEST, 'Invalid cursor')
+
+
+def build_page(items, direction: Optional[str], limit: int, key) -> Page:
+    """Page from `limit + 1` rows fetched in seek order; `key(item)` gives the values a cursor resumes from."""
+    has_more = len(items) > limit
+    items = list(items[:limit])
+    if direction == PREV:
+        items.reverse()
+    if not items:
+        return Page(items, None, None)
+
+    next_cursor = encode_cursor(NEXT, *key(items[-1])) if has_more or direction == PREV else None
+    has_prev = direction == NEXT or (direction == PREV and has_more)
+    prev_cursor = encode_cursor(PREV, *key(items[0])) if has_prev else None
+    return Page(items, next_cursor, prev_cursor)
+
+
+async def keyset_page(db: AsyncSession, query, column, cursor: Optional[str] = None, limit: int = 6) -> Page:
+    """One page of `query` ordered by `column` descending, starting after `cursor`.
+
+    Seeks with `column < last` / `column > first` instead of OFFSET, so deep pages cost the same as the first one.
+    """
+    direction, values = decode_cursor(cursor, int)
+    if direction == NEXT:
+        query = query.where(column < values[0]).order_by(column.desc())
+    elif direction == PREV:
+        query = query.where(column > values[0]).order_by(column.asc())
+    else:
+        query = query.order_by(column.desc())
+
+    items = (await db.scalars(query.limit(limit + 1))).all()
+    return build_page(items, direction, limit, lambda item: (getattr(item, column.key),))
+
+
+class ApproximateCount:
+    """Row count of a table served from memory and refreshed every `ttl` seconds.
+
+    Large tables are estimated from the planner statistics in pg_class instead of running COUNT(*);
+    small ones (below `exact_below` rows) are cheap enough to count exactly.
+    """
+
+    def __init__(self, model, ttl: int = 60, exact_below: int = 10000):
+        self.model = model
+        self.ttl = ttl
+        self.exact_below = exact_below
+        self._value = None
+        self._expires = 0
+
+    async def get(self, db: AsyncSession) -> int:
+        if self._value is None or monotonic() >= self._expires:
+            self._value = await self._fetch(db)
+            self._expires = monotonic() + self.ttl
+        return self._value
+
+    def invalidate(self):
+        self._value = None
+
+    async def _fetch(self, db: AsyncSession) -> int:
+        query = text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)')
+        estimate = await db.scalar(query, {'table': self.model.__tablename__})
+        if estimate is None or estimate < self.exact_below:
+            return await db.scalar(select(func.count()).select_from(self.model))
+        return estimate
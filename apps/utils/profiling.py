@@ -0,0 +1,92 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'pool_wait', 'render_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0  # seconds, as are the ones below
+        self.pool_wait = 0.0
+        self.render_time = 0.0
+
+
+# Stats of the request being handled; None outside a request (startup, worker jobs).
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar('current_stats', default=None)
+
+
+def start_request_stats():
+    """(stats, reset token) for a new request, reusing the stats an outer middleware already started."""
+    stats = current_stats.get()
+    if stats is not None:
+        return stats, None
+    stats = RequestStats()
+    return stats, current_stats.set(stats)
+
+
+_route_names = {}  # endpoint -> route name
+
+
+def route_name(scope: Scope) -> str:
+    """Name of the route (or mount) that handled `scope`, once routing has run; 'unmatched' otherwise."""
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    if endpoint not in _route_names:
+        for route in scope['app'].routes:
+            _route_names.setdefault(getattr(route, 'endpoint', None) or getattr(route, 'app', None),
+                                    route.name or route.path)
+        _route_names.setdefault(endpoint, 'unmatched')
+    return _route_names[endpoint]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Count queries and time spent in them on `engine` (an AsyncEngine) into the current request's stats."""
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    if not event.contains(sync_engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(sync_engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class QueryStatsMiddleware:
+    """Adds ``x-db-queries`` and ``x-db-time`` (ms) response headers, e.g. for benchmark.py."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats, token = start_request_stats()
+
+        async def send_with_stats(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-db-queries', str(stats.queries).encode()),
+                    (b'x-db-time', f'{stats.db_time * 1000:.2f}'.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            if token is not None:
+                current_stats.reset(token)
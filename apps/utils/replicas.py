@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db-primary'
+
+# Seconds the replica is behind; 0 when it has replayed everything it received, however old the last
+# transaction is, and NULL (0) when pointed at a server that is not in recovery.
+LAG_QUERY = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class RequestRouting:
+    __slots__ = ('read_only', 'wrote', 'replica_read')
+
+    def __init__(self, read_only: bool):
+        self.read_only = read_only  # its sessions may read from a replica
+        self.wrote = False
+        self.replica_read = False  # some of its reads were served by a replica, see PageCacheMiddleware
+
+
+# Routing of the request being handled; None outside a request (startup, worker.py), which means the primary.
+current_routing: ContextVar[Optional[RequestRouting]] = ContextVar('current_routing', default=None)
+
+
+class ReplicaSet:
+    """Read replicas; only the ones that passed the last health check get reads.
+
+    A replica is checked every DB_REPLICA_CHECK_INTERVAL and dropped when it does not answer within
+    DB_REPLICA_CHECK_TIMEOUT, lags more than DB_REPLICA_MAX_LAG or a connection to it breaks mid-request.
+    With none healthy every read goes to the primary. Until the first check passes, none is.
+    """
+
+    def __init__(self, engines: list, lag_query: TextClause = LAG_QUERY):
+        self.engines = engines
+        self.lag_query = lag_query
+        self.healthy = []
+        self._next = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        for engine in engines:
+            event.listen(engine.sync_engine, 'handle_error', self._on_error)
+
+    @staticmethod
+    def name(engine: AsyncEngine) -> str:
+        return engine.url.render_as_string(hide_password=True)
+
+    def pick(self) -> Optional[AsyncEngine]:
+        healthy = self.healthy
+        return healthy[next(self._next) % len(healthy)] if healthy else None
+
+    def mark_down(self, engine: AsyncEngine, reason):
+        if engine in self.healthy:
+            self.healthy = [healthy for healthy in self.healthy if healthy is not engine]
+            logger.warning('db replica %s is down, its reads go to the primary: %s', self.name(engine), reason)
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            engine = next(engine for engine in self.engines if engine.sync_engine is context.engine)
+            self.mark_down(engine, context.original_exception)
+
+    async def lag(self, engine: AsyncEngine) -> float:
+        async with engine.connect() as conn:
+            return float(await conn.scalar(self.lag_query) or 0)
+
+    async def check(self):
+        healthy = []
+        for engine in self.engines:
+            try:
+                lag = await asyncio.wait_for(self.lag(engine), settings.DB_REPLICA_CHECK_TIMEOUT)
+            except (asyncio.TimeoutError, OSError, SQLAlchemyError) as exc:
+                self.mark_down(engine, str(exc) or 'health check timed out')
+                continue
+            if lag > settings.DB_REPLICA_MAX_LAG:
+                self.mark_down(engine, f'{lag:.1f}s behind')
+                continue
+            if engine not in self.healthy:
+                logger.info('db replica %s is up, %.1fs behind', self.name(engine), lag)
+            healthy.append(engine)
+        self.healthy = healthy
+
+    async def run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+
+class RoutingSession(Session):
+    """Sends the reads of a read-only request to a healthy replica and everything else to the primary.
+
+    A flush, an INSERT/UPDATE/DELETE or a SELECT ... FOR UPDATE moves the session to the primary for good and
+    marks the request as having written, which pins the client to the primary (see ReplicaRoutingMiddleware).
+    When the replica cannot be connected to, it is marked down and the session reads from the primary instead.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self.routing = current_routing.get()
+        self.replica = None
+        if replicas is not None and self.routing is not None and self.routing.read_only:
+            self.replica = replicas.pick()
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None):
+            self.replica = None
+            if self.routing is not None:
+                self.routing.wrote = True
+        if self.replica is not None:
+            self.routing.replica_read = True
+            return self.replica.sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+    def _connection_for_bind(self, engine, execution_options=None, **kwargs):
+        try:
+            return super()._connection_for_bind(engine, execution_options, **kwargs)
+        except (OSError, DBAPIError) as exc:
+            if self.replica is None or engine is not self.replica.sync_engine:
+                raise
+            self.replicas.mark_down(self.replica, exc)
+            self.replica = None
+            return super()._connection_for_bind(self.bind, execution_options, **kwargs)
+
+
+class ReplicaRoutingMiddleware:
+    """Lets the sessions of GET/HEAD requests read from replicas, except for clients that wrote recently.
+
+    A request that wrote sets a cookie that keeps its client on the primary for DB_REPLICA_PIN_SECONDS, so
+    the redirect after adding to the cart or liking shows the change whatever the replication lag is.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        pinned = PIN_COOKIE in HTTPConnection(scope).cookies
+        routing = RequestRouting(read_only=scope['method'] in ('GET', 'HEAD') and not pinned)
+        token = current_routing.set(routing)
+
+        async def send_with_pin(message):
+            if message['type'] == 'http.response.start' and routing.wrote:
+                cookie = f'{PIN_COOKIE}=1; Max-Age={settings.DB_REPLICA_PIN_SECONDS}; Path=/; HttpOnly; SameSite=lax'
+                message['headers'] = list(message.get('headers', [])) + [(b'set-cookie', cookie.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_pin)
+        finally:
+            current_routing.reset(token)
@@ -1,17 +1,10 @@
 import base64
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from apps import models
+from apps.utils.outbox import enqueue_email
 from apps.utils.token import make_token
-from config import settings
-
-
-def __send_email_message(msg):
-    with smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT) as server:
-        server.login(settings.SMTP_EMAIL, settings.SMTP_PASSWORD)
-        server.send_message(msg)
 
 
 def encode_data(pk):
@@ -22,14 +15,11 @@ def decode_data(uid):
     return base64.urlsafe_b64decode(uid).decode('utf-8')
 
 
-def send_verification_email(user: models.Users, host) -> None:
+def queue_verification_email(db: AsyncSession, user: models.Users, host) -> None:
+    """Put the activation link for a flushed `user` in the outbox, within the caller's transaction."""
     token = make_token(user)
     uid = encode_data(user.id).decode('utf-8')
 
-    message = MIMEMultipart()
-    message['Subject'] = 'Activation link'
-    message['From'] = settings.SMTP_EMAIL
-    message['To'] = user.email
     html = f"""\
     <html>
       <body>
@@ -40,5 +30,4 @@ def send_verification_email(user: models.Users, host) -> None:
       </p>
     </html>
     """
-    message.attach(MIMEText(html, 'html'))
-    __send_email_message(message)
+    enqueue_email(db, user.email, 'Activation link', html)
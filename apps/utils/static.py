@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import os
+import re
+from mimetypes import guess_type
+
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip sidecars are always built
+    brotli = None
+
+COMPRESSIBLE = {'.css', '.js', '.map', '.json', '.svg', '.html', '.txt', '.xml', '.ico', '.ttf', '.eot', '.otf'}
+MIN_COMPRESS_SIZE = 1024
+FINGERPRINT_LENGTH = 12
+FINGERPRINT_RE = re.compile(r'^(?P<base>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+def _sidecar_is_fresh(source: str, sidecar: str) -> bool:
+    return os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(source)
+
+
+def _write_sidecar(path: str, content: bytes):
+    # workers starting together build the same sidecars: never serve a half written one
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+def build_manifest(directory: str) -> dict:
+    """Hash every file under `directory` and write its missing or outdated .gz/.br sidecars.
+
+    Returns ``{relative path: {'hash': sha256, 'encodings': [...]}}``. Sidecars newer than their source are kept,
+    so after `make static` only the hashing is left to do.
+    """
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.endswith(('.gz', '.br', '.tmp')):
+                continue
+            full_path = os.path.join(root, name)
+            with open(full_path, 'rb') as file:
+                content = file.read()
+            encodings = []
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE and len(content) >= MIN_COMPRESS_SIZE:
+                if brotli is not None:
+                    if not _sidecar_is_fresh(full_path, full_path + '.br'):
+                        _write_sidecar(full_path + '.br', brotli.compress(content, quality=11))
+                    encodings.append('br')
+                if not _sidecar_is_fresh(full_path, full_path + '.gz'):
+                    _write_sidecar(full_path + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+                encodings.append('gzip')
+            path = os.path.relpath(full_path, directory).replace(os.sep, '/')
+            files[path] = {'hash': hashlib.sha256(content).hexdigest(), 'encodings': encodings}
+    return files
+
+
+class CompressedStaticFiles(StaticFiles):
+    """StaticFiles serving precompressed sidecars, strong ETags and fingerprinted URLs.
+
+    ``theme.min.<hash>.css`` resolves to ``theme.min.css`` and is served as immutable; plain URLs must revalidate,
+    which costs a 304 thanks to the content-hash ETag. The manifest is rebuilt in memory at startup, so it always
+    matches the deployed files.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = build_manifest(self.directory)
+
+    def fingerprint(self, path: str) -> str:
+        path = path.lstrip('/')
+        entry = self.manifest.get(path)
+        if entry is None:
+            return path
+        base, ext = os.path.splitext(path)
+        return f'{base}.{entry["hash"][:FINGERPRINT_LENGTH]}{ext}'
+
+    def resolve(self, path: str):
+        """(manifest path, manifest entry, immutable) of a requested path."""
+        path = path.replace(os.sep, '/').lstrip('/')
+        if path in self.manifest:
+            return path, self.manifest[path], False
+        match = FINGERPRINT_RE.match(path)
+        if match:
+            original = match['base'] + match['ext']
+            entry = self.manifest.get(original)
+            if entry is not None:
+                return original, entry, entry['hash'].startswith(match['hash'])
+        return path, None, False
+
+    @staticmethod
+    def negotiate(accept_encoding: str, available: list):
+        accepted = {
+            value.split(';')[0].strip().lower()
+            for value in accept_encoding.split(',')
+            if not value.strip().endswith(';q=0')
+        }
+        return next((encoding for encoding in available if encoding in accepted), None)
+
+    async def get_response(self, path: str, scope: Scope):
+        path, entry, immutable = self.resolve(path)
+        if entry is None or scope['method'] not in ('GET', 'HEAD'):
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        encoding = self.negotiate(request_headers.get('accept-encoding', ''), entry['encodings'])
+        etag = '"%s%s"' % (entry['hash'], '-' + encoding if encoding else '')
+        headers = {
+            'etag': etag,
+            'vary': 'Accept-Encoding',
+            'cache-control': IMMUTABLE if immutable else REVALIDATE,
+        }
+        if etag in [tag.strip() for tag in request_headers.get('if-none-match', '').split(',')]:
+            return NotModifiedResponse(Headers(headers))
+
+        full_path = os.path.join(self.directory, *path.split('/'))
+        media_type = guess_type(path)[0] or 'application/octet-stream'
+        if encoding:
+            headers['content-encoding'] = encoding
+            full_path += '.br' if encoding == 'br' else '.gz'
+        return FileResponse(full_path, headers=headers, media_type=media_type, method=scope['method'])
+
+
+def install_static_url_for(templates, static: CompressedStaticFiles, name: str = 'static'):
+    """Make ``url_for('static', path=...)`` in templates emit fingerprinted URLs."""
+    url_for = templates.env.globals['url_for']
+
+    @pass_context
+    def fingerprinted_url_for(context, route_name: str, **path_params):
+        if route_name == name and 'path' in path_params:
+            path_params['path'] = static.fingerprint(path_params['path'])
+        return url_for(context, route_name, **path_params)
+
+    templates.env.globals['url_for'] = fingerprinted_url_for
+
+
+if __name__ == '__main__':
+    import sys
+
+    manifest = build_manifest(sys.argv[1] if len(sys.argv) > 1 else 'static')
+    print(f'{len(manifest)} files, {sum(bool(entry["encodings"]) for entry in manifest.values())} compressed')
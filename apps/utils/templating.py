@@ -0,0 +1,57 @@
+import os
+
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from apps.utils.cache import TTLCache
+from config import settings
+
+fragment_cache = TTLCache(maxsize=settings.FRAGMENT_CACHE_SIZE, ttl=settings.FRAGMENT_CACHE_TTL)
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache 'product-card', product.id, product.updated_at, ttl=300 %} ... {% endcache %}``
+
+    Renders the body once per key and serves it from `fragment_cache` until the ttl runs out;
+    put a version (e.g. ``updated_at``) in the key so edits show up immediately.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = []
+        ttl = nodes.Const(None)
+        while parser.stream.current.type != 'block_end':
+            if key:
+                parser.stream.expect('comma')
+            if parser.stream.current.test('name:ttl') and parser.stream.look().test('assign'):
+                next(parser.stream)
+                next(parser.stream)
+                ttl = parser.parse_expression()
+            else:
+                key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [nodes.Tuple(key, 'load'), ttl])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, ttl, caller):
+        if (value := fragment_cache.get(key)) is not None:
+            return value
+        value = Markup(caller())
+        fragment_cache.set(key, value, ttl)
+        return value
+
+
+def setup_templates(templates):
+    """Disk bytecode cache plus the fragment cache tag on the app's Jinja environment."""
+    os.makedirs(settings.JINJA_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(settings.JINJA_CACHE_DIR)
+    templates.env.add_extension(FragmentCacheExtension)
+
+
+def precompile_templates(templates):
+    """Compile (or load from the bytecode cache) every template so a worker's first request does not pay for it."""
+    for name in templates.env.list_templates(extensions=['html']):
+        templates.env.get_template(name)
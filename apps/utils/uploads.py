@@ -0,0 +1,106 @@
+import hashlib
+import os
+import uuid
+
+from fastapi import UploadFile, HTTPException
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+
+CHUNK_SIZE = 1024 * 1024
+TOO_LARGE = 'Request body too large'
+
+
+def _content_path(folder: str, digest: str, extension: str) -> str:
+    """media/<folder>/ab/cd/abcd...<ext> - two levels of sharding keep directories small."""
+    return os.path.join(settings.MEDIA_ROOT, folder, digest[:2], digest[2:4], digest + extension)
+
+
+def _publish(tmp_path: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+async def store_upload(upload: UploadFile, folder: str, max_size: int = None) -> str:
+    """Stream `upload` to disk without blocking the event loop and return its content-addressed path.
+
+    The file is hashed while it is written, so identical uploads end up as one file whatever their names,
+    and anything larger than `max_size` bytes is rejected with 413 before it is fully read.
+    """
+    max_size = max_size or settings.UPLOAD_MAX_SIZE
+    tmp_folder = os.path.join(settings.MEDIA_ROOT, 'tmp')
+    await run_in_threadpool(os.makedirs, tmp_folder, exist_ok=True)
+    tmp_path = os.path.join(tmp_folder, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    size = 0
+    buffer = await run_in_threadpool(open, tmp_path, 'wb')
+    try:
+        while chunk := await upload.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, TOO_LARGE)
+            digest.update(chunk)
+            await run_in_threadpool(buffer.write, chunk)
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(os.remove, tmp_path)
+        raise
+    await run_in_threadpool(buffer.close)
+
+    extension = os.path.splitext(upload.filename or '')[1].lower()
+    path = _content_path(folder, digest.hexdigest(), extension)
+    await run_in_threadpool(_publish, tmp_path, path)
+    return path
+
+
+class BodySizeLimitMiddleware:
+    """Answers 413 to requests whose body exceeds `max_size` bytes before the form is parsed.
+
+    A declared Content-Length over the limit is refused without reading the body; otherwise the body is counted
+    as it arrives and the request is cut off, as a client disconnect, at the first chunk over the limit.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int = None):
+        self.app = app
+        self.max_size = max_size or settings.UPLOAD_MAX_REQUEST_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        length = Headers(scope=scope).get('content-length', '')
+        if length.isdigit() and int(length) > self.max_size:
+            response = PlainTextResponse(TOO_LARGE, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, {'connection': 'close'})
+            return await response(scope, receive, send)
+
+        received = 0
+        refused = False
+
+        async def limited_receive():
+            nonlocal received, refused
+            if refused:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:
+                    refused = True
+                    response = PlainTextResponse(TOO_LARGE, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                                 {'connection': 'close'})
+                    await response(scope, receive, send)
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def guarded_send(message):
+            if not refused:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
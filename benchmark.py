@@ -0,0 +1,245 @@
+"""HTTP benchmarks for the main routes, with results stored as JSON and compared against a baseline.
+
+    python seed.py --truncate                       # once, a catalog worth measuring
+    python benchmark.py --save .benchmarks/baseline.json
+    python benchmark.py --baseline .benchmarks/baseline.json --threshold 0.2
+
+Boots ``uvicorn main:app`` with QUERY_STATS_HEADERS=1 (or targets --url), logs in as a seeded user and drives
+every scenario at --concurrency for --requests requests. Exits with 1 when a route's p95 latency, throughput
+or queries per request regressed by more than --threshold against the baseline.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import aiohttp
+import asyncpg
+
+from config import settings
+
+SCENARIOS = ['product_list', 'product_detail', 'search', 'card', 'like', 'login', 'register']
+SEARCH_TERMS = ['apple', 'samsung', 'pro', 'black', 'ssd', 'lenovo', 'silver', '16gb']
+
+
+class Context:
+    """What the scenarios need to build requests: id ranges from the database and the signed-in user."""
+
+    def __init__(self, product_ids: tuple, user_id: int, email: str, password: str):
+        self.product_ids = product_ids
+        self.user_id = user_id
+        self.email = email
+        self.password = password
+        self.run = uuid.uuid4().hex[:8]
+        self.counter = itertools.count()
+        self.random = random.Random(42)
+
+    def product(self) -> int:
+        return self.random.randint(*self.product_ids)
+
+
+def build_request(name: str, ctx: Context) -> tuple:
+    """(method, path, form data, send the session cookie) of one request of scenario `name`."""
+    if name == 'product_list':
+        return 'GET', '/', None, True
+    if name == 'product_detail':
+        return 'GET', f'/detail/{ctx.product()}', None, True
+    if name == 'search':
+        return 'GET', f'/search?query={ctx.random.choice(SEARCH_TERMS)}', None, True
+    if name == 'card':
+        return 'POST', f'/card/{ctx.product()}/{ctx.user_id}', {}, True
+    if name == 'like':
+        return 'POST', f'/like/{ctx.product()}/{ctx.user_id}', {}, True
+    if name == 'login':
+        return 'POST', '/login', {'email': ctx.email, 'password': ctx.password}, False
+    if name == 'register':
+        email = f'bench{ctx.run}{next(ctx.counter)}@example.com'
+        return 'POST', '/register', {'name': 'Bench', 'email': email, 'password': 'password',
+                                     'confirm_password': 'password'}, False
+    raise ValueError(name)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def run_scenario(url: str, name: str, ctx: Context, cookies: dict, concurrency: int, requests: int) -> dict:
+    latencies, queries, db_times = [], [], []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def user(session_cookies):
+        nonlocal errors
+        async with aiohttp.ClientSession(url, cookies=session_cookies) as session:
+            for _ in remaining:
+                method, path, data, _ = build_request(name, ctx)
+                started = time.perf_counter()
+                async with session.request(method, path, data=data, allow_redirects=False) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                if response.status >= 400:
+                    errors += 1
+                if 'x-db-queries' in response.headers:
+                    queries.append(int(response.headers['x-db-queries']))
+                    db_times.append(float(response.headers['x-db-time']))
+
+    signed_in = build_request(name, ctx)[3]
+    started = time.perf_counter()
+    await asyncio.gather(*(user(cookies if signed_in else {}) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'db_ms_per_request': round(sum(db_times) / len(db_times), 2) if db_times else None,
+    }
+
+
+async def load_context(email: str, password: str) -> Context:
+    conn = await asyncpg.connect(settings.ASYNC_DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://'))
+    try:
+        product_ids = tuple(await conn.fetchrow('SELECT min(id), max(id) FROM product'))
+        user_id = await conn.fetchval('SELECT id FROM users WHERE email = $1', email)
+    finally:
+        await conn.close()
+    if user_id is None or product_ids[0] is None:
+        sys.exit(f'{email} or products are missing, seed the database first (python seed.py)')
+    return Context(product_ids, user_id, email, password)
+
+
+async def sign_in(url: str, ctx: Context) -> dict:
+    async with aiohttp.ClientSession(url) as session:
+        async with session.post('/login', data={'email': ctx.email, 'password': ctx.password},
+                                allow_redirects=False) as response:
+            cookie = response.cookies.get('access-token')
+    if cookie is None:
+        sys.exit(f'could not sign in as {ctx.email}')
+    return {'access-token': cookie.value}
+
+
+async def wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(url) as session:
+        while True:
+            try:
+                async with session.get('/login') as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                sys.exit(f'{url} did not come up in {timeout}s')
+            await asyncio.sleep(0.5)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Regressions of `results` against `baseline` beyond `threshold` (0.2 = 20%)."""
+    regressions = []
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]} -> {current["p95_ms"]} ms')
+        if current['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f'{name}: throughput {previous["throughput"]} -> {current["throughput"]} req/s')
+        if (current['queries_per_request'] or 0) > (previous['queries_per_request'] or 0) * (1 + threshold):
+            regressions.append(
+                f'{name}: queries {previous["queries_per_request"]} -> {current["queries_per_request"]}'
+            )
+    return regressions
+
+
+def print_table(results: dict, baseline: dict = None):
+    print(f'{"route":16}{"req/s":>10}{"p50":>10}{"p95":>10}{"p99":>10}{"queries":>9}{"errors":>8}')
+    for name, row in results['routes'].items():
+        line = f'{name:16}{row["throughput"]:>10}{row["p50_ms"]:>10}{row["p95_ms"]:>10}{row["p99_ms"]:>10}' \
+               f'{row["queries_per_request"] if row["queries_per_request"] is not None else "-":>9}{row["errors"]:>8}'
+        previous = (baseline or {}).get('routes', {}).get(name)
+        if previous:
+            line += f'   p95 {(row["p95_ms"] / previous["p95_ms"] - 1) * 100 if previous["p95_ms"] else 0:+.0f}%'
+        print(line)
+
+
+async def main(args) -> int:
+    server = None
+    url = args.url
+    if url is None:
+        url = f'http://127.0.0.1:{args.port}'
+        env = {**os.environ, 'QUERY_STATS_HEADERS': '1', 'PAGE_CACHE_ENABLED': '1' if args.page_cache else '0',
+               'WEB_CONCURRENCY': str(args.workers)}
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(args.port), '--workers', str(args.workers),
+             '--log-level', 'warning'],
+            env=env
+        )
+    try:
+        await wait_until_up(url)
+        ctx = await load_context(args.email, args.password)
+        cookies = await sign_in(url, ctx)
+        results = {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                         text=True).stdout.strip(),
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'workers': args.workers,
+            },
+            'routes': {},
+        }
+        for name in args.scenarios:
+            await run_scenario(url, name, ctx, cookies, args.concurrency, args.warmup)
+            results['routes'][name] = await run_scenario(url, name, ctx, cookies, args.concurrency, args.requests)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_table(results, baseline)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the app routes and compare against a baseline.')
+    parser.add_argument('--url', help='benchmark a running server instead of booting one')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50, help='unmeasured requests per scenario')
+    parser.add_argument('--email', default='user1@example.com', help='seeded user to sign in as')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--page-cache', action='store_true', help='keep the full-page cache on')
+    parser.add_argument('--save', default='.benchmarks/latest.json', help='where to write the results')
+    parser.add_argument('--baseline', help='results to compare against; regressions exit with 1')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+    sys.exit(asyncio.run(main(parser.parse_args())))
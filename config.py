@@ -19,7 +19,8 @@ class CustomURLProcessor:
 
     def include_query_params(self, **params: str):
         parsed = list(urllib.parse.urlparse(self.path))
-        parsed[4] = urllib.parse.urlencode(params)
+        parsed[4] = urllib.parse.urlencode({key: value for key, value in params.items() if value is not None},
+                                           doseq=True)
         return urllib.parse.urlunparse(parsed)
 
 
@@ -40,17 +41,89 @@ class Settings:
     POSTGRES_DB: str = os.getenv("POSTGRES_DB", "tdd")
 
     DATABASE_URL = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    ASYNC_DATABASE_URL = (
+        f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    )
+
+    # WEB_CONCURRENCY is also uvicorn's default for --workers; each worker gets an equal share of DB_MAX_CONNECTIONS
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 80))  # this app's share of Postgres max_connections
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', max(1, DB_MAX_CONNECTIONS // WEB_CONCURRENCY * 3 // 4)))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', max(0, DB_MAX_CONNECTIONS // WEB_CONCURRENCY - DB_POOL_SIZE)))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))  # in seconds
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # in seconds
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    DB_POOL_WAIT_WARNING = float(os.getenv('DB_POOL_WAIT_WARNING', 0.1))  # in seconds
+    DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', '0') == '1'  # behind a transaction pooler such as PgBouncer
+    # comma separated postgresql+asyncpg:// URLs of read replicas, each with a pool sized like the primary's
+    DB_REPLICA_URLS = [url for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url]
+    DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))  # reads stay on the primary after a write
+    DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 2))  # in seconds
+    DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))  # in seconds
+    DB_REPLICA_CHECK_TIMEOUT = float(os.getenv('DB_REPLICA_CHECK_TIMEOUT', 2))  # in seconds
 
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_Minutes = 3600  # in mins
     ACTIVATE_TOKEN_TIMEOUT = 60 * 60  # in seconds
 
+    CATALOG_COUNT_TTL = int(os.getenv('CATALOG_COUNT_TTL', 60))  # in seconds
+    # Per worker process: a profile change or logout only evicts the entry in the worker that handled it, the
+    # others serve the old user until it expires, so keep it short when running several workers.
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300 if WEB_CONCURRENCY == 1 else 10))  # in seconds
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    CART_CACHE_TTL = int(os.getenv('CART_CACHE_TTL', 300 if WEB_CONCURRENCY == 1 else 10))  # per process too
+    CART_CACHE_SIZE = int(os.getenv('CART_CACHE_SIZE', 10000))
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'postgres')  # postgres | memory
+    SPEC_FACET_VALUES = int(os.getenv('SPEC_FACET_VALUES', 10))  # most common values shown per specification
+
+    JINJA_CACHE_DIR = os.getenv('JINJA_CACHE_DIR', '.jinja_cache')
+    FRAGMENT_CACHE_TTL = int(os.getenv('FRAGMENT_CACHE_TTL', 300))  # in seconds
+    FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 5000))
+    MEDIA_ROOT = os.getenv('MEDIA_ROOT', 'media')
+    UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 10 * 1024 * 1024))  # in bytes, per file
+    UPLOAD_MAX_REQUEST_SIZE = int(os.getenv('UPLOAD_MAX_REQUEST_SIZE', 5 * UPLOAD_MAX_SIZE))  # whole request body
+    IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+    PAGE_CACHE_BACKEND = os.getenv('PAGE_CACHE_BACKEND', 'memory')  # memory | file
+    # The memory backend is per process and purges only reach the process that ran them, while worker.py (jobs,
+    # outbox) always purges from its own process: on by default only with the file backend shared by the host.
+    PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', '1' if PAGE_CACHE_BACKEND == 'file' else '0') == '1'
+    PAGE_CACHE_DIR = os.getenv('PAGE_CACHE_DIR', '.page_cache')
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 300))  # in seconds
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'  # GET /metrics in Prometheus text format
+    NPLUSONE_MODE = os.getenv('NPLUSONE_MODE', 'off')  # off | log | raise, for development and tests
+    NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 3))  # repeats of one statement per request
+    QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 15))  # queries per request
+    QUERY_BUDGETS = {  # per route name, e.g. QUERY_BUDGETS=product_list=6,search=5
+        name: int(budget) for name, budget in
+        (item.split('=') for item in os.getenv('QUERY_BUDGETS', '').split(',') if item)
+    }
+    QUERY_STATS_HEADERS = os.getenv('QUERY_STATS_HEADERS', '0') == '1'  # x-db-queries / x-db-time, see benchmark.py
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))  # existing hashes are upgraded on login
+    HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+    HASH_MAX_PENDING = int(os.getenv('HASH_MAX_PENDING', 64))
+
     TEST_USER_EMAIL = "test@example.com"
     SMTP_HOST = os.getenv('SMTP_HOST')
     SMTP_PORT = os.getenv('SMTP_PORT')
     SMTP_EMAIL = os.getenv('SMTP_EMAIL')
     SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+    SMTP_USE_SSL = os.getenv('SMTP_USE_SSL', '1') == '1'
+    SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', 30))  # in seconds
+    SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', 60))  # in seconds
+    OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', '0') == '1'  # also drain from the web process, not only worker.py
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_RATE_LIMIT = float(os.getenv('OUTBOX_RATE_LIMIT', 10))  # messages per second
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_RETRY_BACKOFF = int(os.getenv('OUTBOX_RETRY_BACKOFF', 30))  # in seconds, doubled per attempt
+    OUTBOX_RETRY_BACKOFF_MAX = int(os.getenv('OUTBOX_RETRY_BACKOFF_MAX', 3600))  # in seconds
+    OUTBOX_POLL_INTERVAL = int(os.getenv('OUTBOX_POLL_INTERVAL', 5))  # in seconds
+    JOB_DATABASE_URL = os.getenv('JOB_DATABASE_URL')  # e.g. sqlite+aiosqlite:///jobs.db, default: the main database
+    JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 4))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))  # in seconds
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', 300))  # in seconds
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_BACKOFF = int(os.getenv('JOB_RETRY_BACKOFF', 10))  # in seconds, doubled per attempt
 
 
 settings = Settings()
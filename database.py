@@ -1,16 +1,93 @@
-from sqlalchemy.engine import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+import time
+from uuid import uuid4
 
+from sqlalchemy import DateTime
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from sqlalchemy.sql.functions import FunctionElement
+
+from apps.utils.replicas import ReplicaSet, RoutingSession
 from config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+logger = logging.getLogger(__name__)
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """The default async pool, logging checkouts that had to wait because every connection was in use.
+
+    `observers` are called with every checkout's wait in seconds (see apps/utils/metrics.py).
+    """
+
+    observers = []
+
+    def _do_get(self):
+        saturated = self.checkedout() >= self.size() + max(self._max_overflow, 0)
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            logger.error('db pool: no connection within %ss, %s', self._timeout, self.status())
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            if saturated and waited >= settings.DB_POOL_WAIT_WARNING:
+                logger.warning('db pool saturated: waited %.0f ms for a connection, %s', waited * 1000, self.status())
+            for observer in self.observers:
+                observer(waited)
+
+
+def engine_options() -> dict:
+    """Pool arguments for `create_async_engine`, from the DB_* settings.
+
+    With DB_PGBOUNCER the transaction pooler owns pooling: connections are not kept (NullPool) and
+    asyncpg's prepared statements are uncached and uniquely named, since consecutive statements may land
+    on different server connections.
+    """
+    if settings.DB_PGBOUNCER:
+        return {
+            'poolclass': NullPool,
+            'connect_args': {
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__',
+            },
+        }
+    return {
+        'poolclass': MonitoredPool,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+    }
+
+
+engine = create_async_engine(settings.ASYNC_DATABASE_URL, **engine_options())
+replicas = ReplicaSet([create_async_engine(url, **engine_options()) for url in settings.DB_REPLICA_URLS])
+
+Session = async_sessionmaker(engine, class_=AsyncSession, sync_session_class=RoutingSession, replicas=replicas,
+                             autoflush=False, expire_on_commit=False)
+
+
+class seconds_from_now(FunctionElement):
+    """The database clock plus `seconds`; due times are only ever compared with the database's own now()."""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(seconds_from_now)
+def compile_seconds_from_now(element, compiler, **kw):
+    return 'now() + make_interval(secs => %s)' % compiler.process(element.clauses, **kw)
+
 
-Session = sessionmaker(engine, autoflush=False)
+@compiles(seconds_from_now, 'sqlite')
+def compile_seconds_from_now_sqlite(element, compiler, **kw):
+    return "datetime('now', %s || ' seconds')" % compiler.process(element.clauses, **kw)
 
 
-def get_db():
-    db = Session()
-    try:
+async def get_db():
+    async with Session() as db:
         yield db
-    finally:
-        db.close()
@@ -3,17 +3,32 @@ from random import choice
 import uvicorn
 from faker import Faker
 from fastapi import FastAPI
-from sqlalchemy import update
+from sqlalchemy import update, select
 from starlette import status
 from starlette.exceptions import HTTPException
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, PlainTextResponse
 from starlette.staticfiles import StaticFiles
 
 from apps import models
 from apps.models import Base
 from apps.routers import api, auth, product_api
-from config import manager, templates
-from database import get_db, engine
+from apps.search import search_backend
+from apps.hashing import hashing_pool
+from apps.utils.images import shutdown_executor
+from apps.utils.jobs import create_tables as create_job_tables
+from apps.utils.outbox import outbox
+from apps.utils.metrics import install_metrics
+from apps.utils.nplusone import install_nplusone
+from apps.utils.page_cache import PageCacheMiddleware
+from apps.utils.profiling import QueryStatsMiddleware, instrument_engine
+from apps.utils.replicas import ReplicaRoutingMiddleware
+from apps.utils.catalog import spec_params
+from apps.utils.static import CompressedStaticFiles, install_static_url_for
+from apps.utils.uploads import BodySizeLimitMiddleware
+from apps.utils.templating import setup_templates, precompile_templates
+from apps.utils.cache import user_cache
+from config import manager, templates, settings
+from database import engine, replicas, Session
 
 #
 # class BasicAuthBackend(AuthenticationBackend):
@@ -36,14 +51,31 @@ from database import get_db, engine
 #
 
 app = FastAPI()
+app.add_middleware(PageCacheMiddleware)
 manager.useRequest(app)
+if settings.DB_REPLICA_URLS:
+    app.add_middleware(ReplicaRoutingMiddleware)
+app.add_middleware(BodySizeLimitMiddleware)
+if settings.QUERY_STATS_HEADERS:
+    for db_engine in [engine, *replicas.engines]:
+        instrument_engine(db_engine)
+    app.add_middleware(QueryStatsMiddleware)
+if settings.METRICS_ENABLED:
+    install_metrics(app, [engine, *replicas.engines], templates)
+if settings.NPLUSONE_MODE != 'off':
+    install_nplusone(app, [engine, *replicas.engines])
+setup_templates(templates)
 
 
 @manager.user_loader()
-def load_user(email: str):
-    db = next(get_db())
-    user = db.query(models.Users).where(models.Users.email == email, models.Users.is_active).first()
-    db.close()
+async def load_user(email: str):
+    if (user := user_cache.get(email)) is not None:
+        return user
+    async with Session() as db:
+        query = select(models.Users).where(models.Users.email == email, models.Users.is_active)
+        user = await db.scalar(query)
+    if user is not None:
+        user_cache.set(email, user)
     return user
 
 
@@ -57,7 +89,10 @@ def exc_handler(request, exc):
 
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request, exc):
-    return templates.TemplateResponse('errors/404.html', {"request": request}, status.HTTP_404_NOT_FOUND)
+    # signed-out visitors of private pages get the not found page too
+    if exc.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_404_NOT_FOUND):
+        return templates.TemplateResponse('errors/404.html', {"request": request}, status.HTTP_404_NOT_FOUND)
+    return PlainTextResponse(exc.detail, exc.status_code, headers=exc.headers)
 
 
 # manager.not_authenticated_exception = NotAuthenticatedException
@@ -65,17 +100,28 @@ async def custom_http_exception_handler(request, exc):
 
 # app.add_middleware(AuthenticationMiddleware, backend=BasicAuthBackend())
 
-app.mount("/static", StaticFiles(directory='static'), name='static')
+static_files = CompressedStaticFiles(directory='static')
+install_static_url_for(templates, static_files)
+templates.env.globals['spec_params'] = spec_params
+app.mount("/static", static_files, name='static')
 app.mount("/media", StaticFiles(directory='media'), name='media')
 
 
 @app.on_event("startup")
-def startup():
+async def startup():
     # Base.metadata.drop_all(engine)
     # Base.metadata.create_all(engine)
     app.include_router(api)
     app.include_router(auth)
     app.include_router(product_api)
+    precompile_templates(templates)
+    await create_job_tables()
+
+    async with Session() as db:
+        await search_backend.rebuild(db)
+    if settings.OUTBOX_ENABLED:
+        outbox.start()
+    replicas.start()
 
     # db = next(get_db())
     # query = update(models.Users).where(models.Users.id == 1).values(name='123')
@@ -114,5 +160,13 @@ def startup():
     # db.commit()
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_executor()
+    hashing_pool.shutdown()
+    await outbox.stop()
+    await replicas.stop()
+
+
 if __name__ == '__main__':
     uvicorn.run('main:app', host='0.0.0.0', port=8000, reload=True)
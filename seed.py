@@ -0,0 +1,185 @@
+"""Fill the database with a reproducible, production-sized catalog for load testing.
+
+    python seed.py --users 100000 --products 1000000 --seed 42
+
+Rows are generated with Faker from a fixed seed and streamed through Postgres COPY in batches,
+continuing after the highest existing id of every table. Every seeded user has the password ``password``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import asyncpg
+from faker import Faker
+
+from apps.hashing import Hasher
+from config import settings
+
+SPECIFICATIONS = {
+    'Brand Name': ['Apple', 'Samsung', 'Lenovo', 'Asus', 'Xiaomi', 'Dell', 'HP', 'Sony', 'LG', 'Acer'],
+    'Memory': ['4GB', '8GB', '16GB', '32GB', '64GB'],
+    'Storage': ['128GB SSD', '256GB SSD', '512GB SSD', '1TB SSD', '2TB HDD'],
+    'Processor': ['Intel Core i3', 'Intel Core i5', 'Intel Core i7', 'AMD Ryzen 5', 'AMD Ryzen 7', 'Apple M2'],
+    'Color': ['Black', 'Silver', 'Space Gray', 'White', 'Blue', 'Red'],
+    'Screen Size': ['6.1"', '6.7"', '13.3"', '14"', '15.6"', '17.3"'],
+    'Warranty': ['1 year', '2 years', '3 years'],
+}
+POOL_SIZE = 5000  # distinct Faker strings per kind; rows combine them so Faker is not the bottleneck
+
+
+class Seeder:
+    def __init__(self, conn: asyncpg.Connection, seed: int, batch_size: int):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        fake = Faker()
+        Faker.seed(seed)
+        self.names = [fake.name() for _ in range(POOL_SIZE)]
+        self.words = [fake.word() for _ in range(POOL_SIZE)]
+        self.sentences = [fake.sentence() for _ in range(POOL_SIZE)]
+        self.paragraphs = [fake.paragraph() for _ in range(POOL_SIZE // 10)]
+        self.now = datetime(2023, 6, 1)
+
+    async def next_id(self, table: str) -> int:
+        return await self.conn.fetchval(f'SELECT coalesce(max(id), 0) + 1 FROM "{table}"')
+
+    async def copy(self, table: str, columns: list, rows, total: int, estimated: bool = False):
+        """COPY `rows` into `table` in batches, printing progress against `total` to stderr."""
+        started = time.perf_counter()
+        done = 0
+        batch = []
+
+        async def flush():
+            nonlocal done
+            await self.conn.copy_records_to_table(table, records=batch, columns=columns)
+            done += len(batch)
+            batch.clear()
+            rate = done / (time.perf_counter() - started)
+            print(f'\r{table:12} {done:>12,}/{"~" if estimated else ""}{total:,} rows  {rate:>10,.0f} rows/s',
+                  end='', file=sys.stderr)
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                await flush()
+        if batch:
+            await flush()
+        await self.conn.execute(f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                                f'(SELECT coalesce(max(id), 1) FROM "{table}"))')
+        print(f'\r{table:12} {done:>12,} rows in {time.perf_counter() - started:.1f}s' + ' ' * 20, file=sys.stderr)
+
+    def timestamp(self, days: int = 730) -> datetime:
+        return self.now - timedelta(seconds=self.random.randrange(days * 86400))
+
+    def pairs(self, first_ids: range, second_ids: range, per_first: int):
+        """Distinct (first, second) pairs, `per_first` per first id on average, for the (user, product) tables."""
+        for first in first_ids:
+            count = self.random.randint(0, 2 * per_first)
+            for second in self.random.sample(second_ids, min(count, len(second_ids))):
+                yield first, second
+
+    async def run(self, users: int, categories: int, products: int, images: int, likes: int, cart: int, reviews: int):
+        r = self.random
+        password = Hasher.get_password_hash('password')
+
+        user_start = await self.next_id('users')
+        user_ids = range(user_start, user_start + users)
+        await self.copy('users', ['id', 'name', 'email', 'is_active', 'password', 'created_at'], (
+            (pk, r.choice(self.names), f'user{pk}@example.com', True, password, self.timestamp())
+            for pk in user_ids
+        ), users)
+
+        category_start = await self.next_id('category')
+        category_ids = range(category_start, category_start + categories)
+        await self.copy('category', ['id', 'name'], (
+            (pk, f'{r.choice(self.words).title()} {r.choice(self.words)}'[:50]) for pk in category_ids
+        ), categories)
+
+        product_start = await self.next_id('product')
+        product_ids = range(product_start, product_start + products)
+        await self.copy('product', [
+            'id', 'name', 'price', 'discount', 'description', 'specifications', 'updated_at',
+            'author_id', 'category_id'
+        ], (
+            (
+                pk,
+                f'{r.choice(self.words).title()} {r.choice(self.words)} {pk}'[:50],
+                Decimal(r.randrange(100, 500000)) / 100,
+                r.choice((0, 0, 0, 5, 10, 15, 20, 30)),
+                r.choice(self.paragraphs)[:512],
+                json.dumps({key: r.choice(values) for key, values in r.sample(list(SPECIFICATIONS.items()), 5)}),
+                self.timestamp(),
+                r.choice(user_ids),
+                r.choice(category_ids),
+            )
+            for pk in product_ids
+        ), products)
+
+        image_start = await self.next_id('productimage')
+        await self.copy('productimage', ['id', 'image', 'product_id'], (
+            (image_start + index, f'static/assets/img/products/{r.randint(1, 8)}.jpg', product_start + index // images)
+            for index in range(products * images)
+        ), products * images)
+
+        like_start = await self.next_id('like')
+        await self.copy('like', ['id', 'user_id', 'product_id', 'total'], (
+            (like_start + index, user, product, 1)
+            for index, (user, product) in enumerate(self.pairs(user_ids, product_ids, likes))
+        ), users * likes, estimated=True)
+
+        card_start = await self.next_id('card')
+        await self.copy('card', ['id', 'user_id', 'product_id', 'total'], (
+            (card_start + index, user, product, r.randint(1, 3))
+            for index, (user, product) in enumerate(self.pairs(user_ids, product_ids, cart))
+        ), users * cart, estimated=True)
+
+        review_start = await self.next_id('review')
+        await self.copy('review', ['id', 'title', 'text', 'star', 'created_at', 'user_id', 'product_id'], (
+            (
+                review_start + index,
+                r.choice(self.sentences)[:255],
+                r.choice(self.paragraphs),
+                r.choices((1, 2, 3, 4, 5), weights=(5, 5, 15, 35, 40))[0],
+                self.timestamp(),
+                user,
+                product,
+            )
+            for index, (product, user) in enumerate(self.pairs(product_ids, user_ids, reviews))
+        ), products * reviews, estimated=True)
+
+        await self.conn.execute('ANALYZE')
+
+
+async def main(args):
+    dsn = settings.ASYNC_DATABASE_URL.replace('postgresql+asyncpg://', 'postgresql://')
+    conn = await asyncpg.connect(dsn)
+    try:
+        if args.truncate:
+            # TRUNCATE fires no delete triggers: empty the trigger-maintained counter tables too
+            await conn.execute('TRUNCATE users, category, product, productimage, "like", card, review, '
+                               'categorycount, specfacet CASCADE')
+        await Seeder(conn, args.seed, args.batch_size).run(
+            args.users, args.categories, args.products, args.images, args.likes, args.cart, args.reviews
+        )
+    finally:
+        await conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed the database with fake catalog data through COPY.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--images', type=int, default=3, help='images per product')
+    parser.add_argument('--likes', type=int, default=5, help='average likes per user')
+    parser.add_argument('--cart', type=int, default=2, help='average cart lines per user')
+    parser.add_argument('--reviews', type=int, default=2, help='reviews per product')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--truncate', action='store_true', help='empty the catalog tables first')
+    asyncio.run(main(parser.parse_args()))
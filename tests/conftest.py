@@ -0,0 +1,120 @@
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import Computed, event
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.dialects.postgresql.json import CONTAINS
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import BinaryExpression
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+from apps import models
+from apps.routers import api, auth, product_api
+from apps.utils.cache import user_cache
+from config import manager
+from database import get_db
+
+
+# The tests run against SQLite: Postgres only types become their plain counterparts and the generated
+# search_vector an ordinary column. Triggers and extensions are created on Postgres only.
+@compiles(JSONB, 'sqlite')
+def compile_jsonb(element, compiler, **kw):
+    return 'JSON'
+
+
+@compiles(TSVECTOR, 'sqlite')
+def compile_tsvector(element, compiler, **kw):
+    return 'TEXT'
+
+
+@compiles(Computed, 'sqlite')
+def compile_computed(element, compiler, **kw):
+    return ''
+
+
+# jsonb ``@>`` (the spec filters) becomes a Python function, for flat objects like the product specifications.
+@compiles(BinaryExpression, 'sqlite')
+def compile_binary(element, compiler, **kw):
+    if element.operator is CONTAINS:
+        return 'jsonb_contains(%s, %s)' % (compiler.process(element.left, **kw), compiler.process(element.right, **kw))
+    return compiler.visit_binary(element, **kw)
+
+
+def jsonb_contains(document, pattern) -> bool:
+    document, pattern = json.loads(document or 'null'), json.loads(pattern)
+    return isinstance(document, dict) and all(document.get(key) == value for key, value in pattern.items())
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+async def engine(anyio_backend, tmp_path):
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/test.db')
+    event.listen(engine.sync_engine, 'connect',
+                 lambda connection, record: connection.create_function('jsonb_contains', 2, jsonb_contains))
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+async def db(session_factory):
+    async with session_factory() as session:
+        yield session
+
+
+@pytest.fixture
+def app(session_factory):
+    """main.py's routes on top of the test database, with its static files and error pages."""
+    from main import static_files, custom_http_exception_handler
+
+    async def get_test_db():
+        async with session_factory() as session:
+            yield session
+
+    app = FastAPI()
+    manager.useRequest(app)
+    app.include_router(api)
+    app.include_router(auth)
+    app.include_router(product_api)
+    app.mount('/static', static_files, name='static')
+    app.add_exception_handler(StarletteHTTPException, custom_http_exception_handler)
+    app.dependency_overrides[get_db] = get_test_db
+    return app
+
+
+@pytest.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+
+
+def log_in(client: httpx.AsyncClient, user: models.Users):
+    """Sign `client` in as `user`; the user is served from user_cache, like after a first request."""
+    user_cache.set(user.email, user)
+    client.cookies.set(manager.cookie_name, manager.create_access_token(data={'sub': user.email}))
+
+
+@pytest.fixture
+def queries(engine):
+    """Statements executed on `engine`, in order."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine.sync_engine, 'before_cursor_execute', record)
@@ -0,0 +1,48 @@
+import pytest
+
+from apps import models
+from apps.utils.cart import cart_summary, invalidate_cart, EMPTY_CART
+from tests.conftest import log_in
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def shop(db):
+    user = models.Users(name='user', email='cart@example.com', is_active=True)
+    category = models.Category(name='phones')
+    products = [models.Product(name=f'product {n}', price=10 * (n + 1), category=category) for n in range(3)]
+    db.add_all([user, category, *products])
+    await db.commit()
+    yield user, products
+    invalidate_cart(user.id)
+
+
+async def test_anonymous_cart_is_empty(db, queries):
+    assert await cart_summary(db, None) == EMPTY_CART
+    assert queries == []
+
+
+async def test_cart_summary(db, shop):
+    user, products = shop
+    db.add_all([models.Card(user_id=user.id, product_id=products[0].id, total=2),
+                models.Card(user_id=user.id, product_id=products[2].id, total=1)])
+    await db.commit()
+    summary = await cart_summary(db, user.id)
+    assert (summary.lines, summary.items, summary.amount) == (2, 3, 40)
+
+
+@pytest.mark.parametrize('url', ['/card_list', '/review'])
+async def test_anonymous_cart_pages(client, url):
+    response = await client.get(url)
+    assert response.status_code == 200
+
+
+async def test_cart_page(client, db, shop):
+    user, products = shop
+    db.add(models.Card(user_id=user.id, product_id=products[1].id, total=3))
+    await db.commit()
+    log_in(client, user)
+    response = await client.get('/card_list')
+    assert response.status_code == 200
+    assert 'product 1' in response.text
@@ -0,0 +1,107 @@
+import html
+import re
+
+import pytest
+from sqlalchemy import select
+
+from apps import models
+from apps.utils.catalog import load_product_page, load_products
+from apps.utils.pagination import encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def catalog(db):
+    user = models.Users(name='user', email='user@example.com')
+    categories = [models.Category(name=f'category {n}') for n in range(3)]
+    products = [
+        models.Product(name=f'product {n}', price=10 + n, author=user, category=categories[n % 3],
+                       specifications={'Color': 'Red' if n % 2 else 'Black'})
+        for n in range(20)
+    ]
+    db.add_all([user, *categories, *products])
+    await db.flush()
+    db.add_all(models.ProductImage(product_id=product.id, image=f'media/{product.id}-{n}.jpg')
+               for product in products for n in range(3))
+    db.add_all(models.Like(user_id=user.id, product_id=product.id) for product in products[::2])
+    await db.commit()
+    return user, products
+
+
+async def test_product_page_query_count(db, catalog, queries):
+    user, products = catalog
+    page, images, liked = await load_product_page(db, select(models.Product), limit=6, user_id=user.id)
+
+    assert [product.id for product in page.items] == [product.id for product in reversed(products)][:6]
+    assert all(product.category.name for product in page.items)
+    assert len(queries) == 3  # categories came with the page, nothing is lazy loaded
+    assert {pk: image.image for pk, image in images.items()} == {
+        product.id: f'media/{product.id}-0.jpg' for product in page.items
+    }
+    assert liked == {product.id for product in page.items if product.id in {p.id for p in products[::2]}}
+
+
+async def test_product_page_query_count_does_not_grow(db, catalog, queries):
+    user, products = catalog
+    await load_product_page(db, select(models.Product), limit=2, user_id=user.id)
+    small = len(queries)
+    queries.clear()
+    await load_product_page(db, select(models.Product), limit=20, user_id=user.id)
+    assert len(queries) == small
+
+
+async def test_load_products_keeps_order(db, catalog, queries):
+    user, products = catalog
+    ids = [products[5].id, products[1].id, products[12].id]
+    loaded, images, liked = await load_products(db, ids, user.id)
+
+    assert [product.id for product in loaded] == ids
+    assert set(images) == set(ids)
+    assert liked == {products[12].id}
+    assert len(queries) == 3
+
+
+async def test_anonymous_page_skips_likes(db, catalog, queries):
+    page, images, liked = await load_product_page(db, select(models.Product))
+    assert liked == set()
+    assert len(queries) == 2
+
+
+def listing(response) -> tuple:
+    """(product names, {'Previous' | 'Next': url}) of a product list page."""
+    names = re.findall(r'>\s*(product \d+)\s*<', response.text)
+    links = re.findall(r'<a href="([^"]+)">\s*<button[^>]*title="(Previous|Next)"', response.text)
+    return names, {title: html.unescape(url) for url, title in links}
+
+
+async def test_listing_follows_cursors_with_filters(client, catalog):
+    user, products = catalog
+    category_id = products[0].category_id
+    response = await client.get('/', params={'category': category_id, 'limit': 1, 'spec.Color': 'Black'})
+    pages = []
+    while True:
+        assert response.status_code == 200
+        names, links = listing(response)
+        pages.append(names)
+        if 'Next' not in links:
+            break
+        response = await client.get(links['Next'])
+    # category 0 and Color=Black: every sixth product, newest first
+    assert pages == [['product 18'], ['product 12'], ['product 6'], ['product 0']]
+    assert 'Previous' in links
+
+    backwards = []
+    while 'Previous' in links:
+        response = await client.get(links['Previous'])
+        names, links = listing(response)
+        backwards.append(names)
+    assert backwards == [['product 6'], ['product 12'], ['product 18']]
+    assert 'Next' in links
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', encode_cursor('x', 5), encode_cursor('n', 'five'),
+                                    encode_cursor('n', 2 ** 40), encode_cursor('n', 1, 2)])
+async def test_tampered_cursor_is_a_bad_request(client, catalog, cursor):
+    response = await client.get('/', params={'cursor': cursor})
+    assert response.status_code == 400
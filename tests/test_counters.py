@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select, func
+
+from apps import models
+from apps.utils import page_cache
+from apps.utils.page_cache import MemoryBackend, product_tag
+
+pytestmark = pytest.mark.anyio
+
+PARALLEL = 50
+
+
+@pytest.fixture
+async def shop(db):
+    users = [models.Users(name=f'user {n}', email=f'user{n}@example.com') for n in range(PARALLEL)]
+    product = models.Product(name='product', price=10, category=models.Category(name='phones'))
+    db.add_all([*users, product])
+    await db.commit()
+    return users, product
+
+
+async def test_parallel_add_to_cart(client, db, shop):
+    users, product = shop
+    user = users[0]
+    responses = await asyncio.gather(*(client.post(f'/card/{product.id}/{user.id}') for _ in range(PARALLEL)))
+
+    assert {response.status_code for response in responses} == {303}
+    lines = (await db.scalars(select(models.Card).where(models.Card.user_id == user.id))).all()
+    assert [(line.product_id, line.total) for line in lines] == [(product.id, PARALLEL)]
+
+
+async def test_parallel_likes_from_many_users(client, db, shop):
+    users, product = shop
+    responses = await asyncio.gather(*(client.post(f'/like/{product.id}/{user.id}') for user in users))
+
+    assert {response.status_code for response in responses} == {303}
+    query = select(func.count(), func.count(func.distinct(models.Like.user_id))).where(
+        models.Like.product_id == product.id)
+    assert (await db.execute(query)).one() == (PARALLEL, PARALLEL)
+
+
+async def test_parallel_like_toggles_never_duplicate(client, db, shop):
+    users, product = shop
+    user = users[0]
+    responses = await asyncio.gather(*(client.post(f'/like/{product.id}/{user.id}') for _ in range(PARALLEL)))
+
+    assert {response.status_code for response in responses} == {303}
+    query = select(func.count()).select_from(models.Like).where(models.Like.user_id == user.id)
+    assert await db.scalar(query) in (0, 1)
+
+
+@pytest.mark.parametrize('route', ['like', 'like_list'])
+async def test_likes_purge_the_pages_showing_like_count(client, shop, route, monkeypatch):
+    users, product = shop
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    await client.post(f'/{route}/{product.id}/{users[0].id}')
+
+    versions = await page_cache.backend.tag_versions(['products', product_tag(product.id)])
+    assert all(versions.values())
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from apps.hashing import HashingPool
+from main import custom_http_exception_handler
+
+pytestmark = pytest.mark.anyio
+
+fast_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=4)
+
+
+@pytest.fixture
+def pool():
+    pool = HashingPool(workers=4, max_pending=1000)
+    yield pool
+    pool.shutdown()
+
+
+async def test_parallel_hashing(pool):
+    passwords = [f'password {n}' for n in range(100)]
+    hashes = await asyncio.gather(*(pool.run(fast_context.hash, password) for password in passwords))
+
+    assert all(fast_context.verify(password, hashed) for password, hashed in zip(passwords, hashes))
+    assert pool.stats() == {'workers': 4, 'pending': 0, 'running': 0, 'queued': 0, 'completed': 100, 'rejected': 0}
+    assert pool.wait_seconds > 0  # 100 hashes on 4 threads queue up
+
+
+async def test_running_count_stays_within_workers(pool):
+    seen = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            seen.append(pool.running)
+        time.sleep(0.001)
+
+    await asyncio.gather(*(pool.run(work) for _ in range(500)))
+    assert max(seen) <= pool.workers
+    assert pool.running == 0
+
+
+async def test_rejects_over_max_pending():
+    pool = HashingPool(workers=1, max_pending=2)
+    try:
+        results = await asyncio.gather(*(pool.run(time.sleep, 0.05) for _ in range(5)), return_exceptions=True)
+    finally:
+        pool.shutdown()
+
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(rejected) == 3 and pool.rejected == 3
+    response = await custom_http_exception_handler(None, rejected[0])
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from PIL import Image
+
+from apps import models
+from apps.utils import images, page_cache
+from apps.utils.page_cache import product_tag
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def product_images(db, session_factory, tmp_path, monkeypatch):
+    monkeypatch.setattr(images, 'Session', session_factory)
+    good = str(tmp_path / 'good.jpg')
+    Image.new('RGB', (1200, 800), 'red').save(good)
+    bad = str(tmp_path / 'bad.jpg')
+    with open(bad, 'wb') as file:
+        file.write(b'not an image')
+
+    products = [models.Product(name=f'product {n}', price=10, category=models.Category(name=f'c{n}'))
+                for n in range(2)]
+    db.add_all(products)
+    await db.flush()
+    rows = [models.ProductImage(product_id=products[0].id, image=good),
+            models.ProductImage(product_id=products[1].id, image=bad)]
+    db.add_all(rows)
+    await db.commit()
+    yield rows
+    images.shutdown_executor()
+
+
+async def test_variants_skip_unreadable_images(db, product_images):
+    good, bad = product_images
+    before = await page_cache.backend.tag_versions(['products', product_tag(good.product_id)])
+
+    await images.build_image_variants([good.id, bad.id])
+
+    await db.refresh(good)
+    await db.refresh(bad)
+    assert set(good.variants) == set(images.SIZES)
+    assert os.path.exists(good.variants['card']['webp'])
+    with Image.open(good.variants['card']['jpeg']) as card:
+        assert card.size == (400, 267)
+    assert bad.variants == {}
+
+    after = await page_cache.backend.tag_versions(['products', product_tag(good.product_id)])
+    assert all(after[tag] > before[tag] for tag in before)
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+
+from apps import models
+from apps.utils import jobs
+from apps.utils.jobs import JobWorker, enqueue, job
+
+pytestmark = pytest.mark.anyio
+
+calls = []
+
+
+@job('tests.record')
+async def record(value):
+    calls.append(value)
+
+
+@pytest.fixture
+async def job_db(anyio_backend, tmp_path, monkeypatch):
+    """A separate JOB_DATABASE_URL."""
+    engine = create_async_engine(f'sqlite+aiosqlite:///{tmp_path}/jobs.db')
+    factory = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    monkeypatch.setattr(jobs, 'engine', engine)
+    monkeypatch.setattr(jobs, 'Session', factory)
+    await jobs.create_tables()
+    async with factory() as session:
+        yield session
+    await engine.dispose()
+
+
+async def queued(job_db):
+    job_db.expire_all()
+    return (await job_db.scalars(select(models.Job).order_by(models.Job.id))).all()
+
+
+async def test_separate_queue_waits_for_the_commit(db, job_db):
+    db.add(models.Category(name='phones'))
+    await enqueue(db, 'tests.record', {'value': 1})
+    assert await queued(job_db) == []
+
+    await db.commit()
+    await asyncio.gather(*jobs._inserts)
+    assert [(row.name, row.payload) for row in await queued(job_db)] == [('tests.record', {'value': 1})]
+
+
+async def test_separate_queue_drops_jobs_on_rollback(db, job_db):
+    await enqueue(db, 'tests.record', {'value': 1})
+    await db.rollback()
+    await db.commit()
+    await asyncio.gather(*jobs._inserts)
+    assert await queued(job_db) == []
+
+
+async def test_worker_runs_jobs(job_db):
+    calls.clear()
+    await enqueue(None, 'tests.record', {'value': 1})
+    await enqueue(None, 'tests.record', {'value': 2})
+    worker = JobWorker()
+    for row in await worker.claim(10):
+        await worker.execute(row)
+
+    assert sorted(calls) == [1, 2]
+    assert {row.status for row in await queued(job_db)} == {'done'}
+
+
+async def test_stale_jobs_are_reclaimed_until_max_attempts(job_db):
+    locked_at = text("datetime('now', '-600 seconds')")
+    job_db.add_all([
+        models.Job(name='tests.record', payload={'value': 1}, status='running', attempts=1, max_attempts=3,
+                   locked_at=locked_at),
+        models.Job(name='tests.record', payload={'value': 2}, status='running', attempts=3, max_attempts=3,
+                   locked_at=locked_at),
+    ])
+    await job_db.commit()
+
+    worker = JobWorker(timeout=300)
+    claimed = await worker.claim(10)
+    assert [(row.payload['value'], row.attempts) for row in claimed] == [(1, 2)]
+    retried, exhausted = await queued(job_db)
+    assert retried.status == 'running'
+    assert (exhausted.status, exhausted.attempts) == ('failed', 3)
+    assert worker.failed == 1
+
+
+@job('tests.fail')
+async def fail():
+    raise ValueError('boom')
+
+
+async def test_failed_job_backs_off(job_db):
+    await enqueue(None, 'tests.fail')
+    worker = JobWorker(backoff=60)
+    [row] = await worker.claim(10)
+    await worker.execute(row)
+
+    assert await worker.claim(10) == []  # due in a minute by the database clock
+    [row] = await queued(job_db)
+    assert (row.status, row.attempts, row.last_error) == ('queued', 1, "ValueError('boom')")
@@ -0,0 +1,53 @@
+import re
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.templating import Jinja2Templates
+from sqlalchemy import text
+
+from apps.utils import metrics
+from apps.utils.cache import user_cache
+from apps.utils.metrics import install_metrics
+from database import MonitoredPool
+
+pytestmark = pytest.mark.anyio
+
+SAMPLE = re.compile(r'[a-z_]+(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.e+-]+|[a-z_]+(\{.*\})? \+?Inf')
+
+
+@pytest.fixture
+async def metrics_client(engine):
+    app = FastAPI()
+
+    @app.get('/categories', name='categories')
+    async def categories():
+        async with engine.connect() as conn:
+            await conn.execute(text('SELECT 1'))
+        return {}
+
+    install_metrics(app, [engine], Jinja2Templates(directory='templates'))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+    MonitoredPool.observers.remove(metrics.observe_pool_wait)
+
+
+async def test_metrics_exposition(metrics_client):
+    user_cache.get('nobody@example.com')
+    await metrics_client.get('/categories')
+    response = await metrics_client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    lines = response.text.splitlines()
+    for metric in metrics.registry:
+        help_line = lines.index(f'# HELP {metric.name} {metric.documentation}')
+        assert lines[help_line + 1] == f'# TYPE {metric.name} {metric.kind}'
+    assert all(SAMPLE.fullmatch(line) for line in lines if not line.startswith('#')), response.text
+
+    samples = dict(line.rsplit(' ', 1) for line in lines if not line.startswith('#'))
+    assert samples['http_requests_total{route="categories",method="GET",status="200"}'] == '1.0'
+    assert samples['db_queries_per_request_count{route="categories"}'] == '1'
+    assert float(samples['cache_misses_total{cache="user"}']) >= 1
+    assert {'cache_hits_total{cache="cart"}', 'cache_entries{cache="fragment"}', 'page_cache_hits_total',
+            'hash_pool_queued', 'hash_pool_wait_seconds_total'} <= samples.keys()
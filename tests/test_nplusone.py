@@ -0,0 +1,93 @@
+import re
+from contextlib import contextmanager
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select, event, text
+from sqlalchemy.orm import Session, joinedload
+
+from apps import models
+from apps.utils import nplusone
+from apps.utils.nplusone import QueryBudgetExceeded, RequestQueries, current_queries, install_nplusone
+from config import settings
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def raising(engine, monkeypatch):
+    """NPLUSONE_MODE=raise on the test engine; returns an app with a route over its query budget."""
+    monkeypatch.setattr(settings, 'NPLUSONE_MODE', 'raise')
+    monkeypatch.setattr(settings, 'NPLUSONE_THRESHOLD', 3)
+    monkeypatch.setattr(settings, 'QUERY_BUDGETS', {'over_budget': 2})
+
+    async def over_budget():
+        async with engine.connect() as conn:
+            for n in range(3):
+                await conn.execute(text(f'SELECT {n}'))
+        return {}
+
+    app = FastAPI()
+    app.add_api_route('/over-budget', over_budget, name='over_budget')
+    install_nplusone(app, [engine])
+    yield app
+    event.remove(engine.sync_engine, 'before_cursor_execute', nplusone._before_cursor_execute)
+    event.remove(Session, 'do_orm_execute', nplusone._do_orm_execute)
+
+
+@contextmanager
+def request_queries():
+    """Track queries as QueryBudgetMiddleware does for a request."""
+    token = current_queries.set(RequestQueries())
+    try:
+        yield
+    finally:
+        current_queries.reset(token)
+
+
+@pytest.fixture
+async def products(db):
+    db.add_all(models.Product(name=f'product {n}', price=10, category=models.Category(name=f'category {n}'))
+               for n in range(5))
+    await db.commit()
+    db.expunge_all()
+
+
+async def test_lazy_loading_loop_raises(db, products, raising):
+    def category_names(session):
+        names = []
+        for product in session.scalars(select(models.Product)):
+            names.append(product.category.name)
+        return names
+
+    with request_queries(), pytest.raises(QueryBudgetExceeded, match=r'Product\.category was lazy loaded 3 times') \
+            as raised:
+        await db.run_sync(category_names)
+    assert re.search(r'from tests/test_nplusone\.py:\d+ in category_names;', str(raised.value))
+
+
+async def test_repeated_statement_reports_its_origin(db, products, raising):
+    async def load_one_by_one():
+        for pk in range(1, 6):
+            await db.scalar(select(models.Product.name).where(models.Product.id == pk))
+
+    with request_queries(), pytest.raises(QueryBudgetExceeded, match=r'same statement ran 3 times') as raised:
+        await load_one_by_one()
+    assert 'from tests/test_nplusone.py:' in str(raised.value)
+    assert 'in load_one_by_one: SELECT product.name' in str(raised.value)
+
+
+async def test_route_over_budget_raises(raising):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=raising), base_url='http://test') as client:
+        with pytest.raises(QueryBudgetExceeded, match='over_budget ran 3 queries, over its budget of 2'):
+            await client.get('/over-budget')
+
+
+async def test_eager_loading_passes(db, products, raising):
+    def category_names(session):
+        query = select(models.Product).options(joinedload(models.Product.category))
+        return [product.category.name for product in session.scalars(query)]
+
+    with request_queries():
+        assert len(await db.run_sync(category_names)) == 5
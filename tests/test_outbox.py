@@ -0,0 +1,114 @@
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select, update, text
+
+from apps import models
+from apps.utils import outbox as outbox_module
+from apps.utils.outbox import OutboxWorker, SMTPConnection, enqueue_email
+
+pytestmark = pytest.mark.anyio
+
+REFUSED = 'refused@example.com'
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address == REFUSED:
+            return '550 no such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode('utf-8', 'replace')))
+        return '250 Message accepted for delivery'
+
+
+@pytest.fixture
+def inbox():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    inbox = Inbox()
+    inbox.port = port
+    controller = Controller(inbox, hostname='127.0.0.1', port=port)
+    controller.start()
+    yield inbox
+    controller.stop()
+
+
+@pytest.fixture
+async def worker(inbox, session_factory, monkeypatch):
+    monkeypatch.setattr(outbox_module, 'Session', session_factory)
+    worker = OutboxWorker(SMTPConnection('127.0.0.1', inbox.port, use_ssl=False), rate=0, max_attempts=2)
+    yield worker
+    await worker.stop()
+
+
+async def queue(db, *recipients):
+    for recipient in recipients:
+        enqueue_email(db, recipient, 'Activate your account', f'<p>Hello {recipient}</p>')
+    await db.commit()
+
+
+async def outbox_rows(db):
+    db.expire_all()
+    return {row.recipient: row for row in await db.scalars(select(models.Outbox))}
+
+
+async def test_sends_batch_over_one_connection(db, inbox, worker):
+    await queue(db, 'a@example.com', 'b@example.com', 'c@example.com')
+
+    assert await worker.drain_once() == 3
+    assert [to for to, _ in inbox.messages] == [['a@example.com'], ['b@example.com'], ['c@example.com']]
+    assert 'Hello a@example.com' in inbox.messages[0][1]
+    rows = await outbox_rows(db)
+    assert {row.status for row in rows.values()} == {'sent'}
+    assert all(row.sent_at is not None and row.attempts == 1 for row in rows.values())
+    assert worker.connection.connects == 1
+    assert await worker.drain_once() == 0
+
+
+async def test_refused_recipient_is_retried_then_failed(db, inbox, worker):
+    await queue(db, REFUSED, 'ok@example.com')
+
+    assert await worker.drain_once() == 2
+    rows = await outbox_rows(db)
+    assert rows['ok@example.com'].status == 'sent'
+    assert rows[REFUSED].status == 'pending' and 'SMTPRecipientsRefused' in rows[REFUSED].last_error
+    assert await worker.drain_once() == 0  # backing off
+
+    await db.execute(update(models.Outbox).values(next_attempt_at=text("datetime('now', '-1 seconds')")))
+    await db.commit()
+    assert await worker.drain_once() == 1
+    assert (await outbox_rows(db))[REFUSED].status == 'failed'
+    assert worker.stats()['sent'] == 1 and worker.retried == 1 and worker.failed == 1
+
+
+async def test_claim_outlives_the_worker(db, inbox, worker):
+    await queue(db, 'a@example.com')
+    claimed = await worker.claim()
+    assert [row.status for row in claimed] == ['sending']
+    assert await worker.drain_once() == 0  # still claimed by the first (dead) worker
+
+    await db.execute(update(models.Outbox).values(next_attempt_at=text("datetime('now', '-1 seconds')")))
+    await db.commit()
+    assert await worker.drain_once() == 1
+    row = (await outbox_rows(db))['a@example.com']
+    assert (row.status, row.attempts) == ('sent', 2)
+
+
+async def test_abandoned_on_last_attempt_fails(db, inbox, worker):
+    await queue(db, 'a@example.com')
+    await db.execute(update(models.Outbox).values(
+        status='sending', attempts=2, next_attempt_at=text("datetime('now', '-1 seconds')")))
+    await db.commit()
+
+    assert await worker.drain_once() == 0
+    row = (await outbox_rows(db))['a@example.com']
+    assert (row.status, row.last_error) == ('failed', 'worker stopped while sending')
+    assert inbox.messages == []
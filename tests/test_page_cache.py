@@ -0,0 +1,127 @@
+import os
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from starlette.responses import PlainTextResponse
+
+from apps import models
+from apps.utils import page_cache
+from apps.utils.page_cache import FileBackend, MemoryBackend, PageCacheMiddleware, cache_page, purge
+from config import manager, settings
+from tests.conftest import log_in
+
+pytestmark = pytest.mark.anyio
+
+
+def entry(body=b'<html></html>'):
+    return {'status': 200, 'headers': {}, 'body': body, 'tags': ['products'], 'rendered': time.time_ns(),
+            'expires': time.time() + 60}
+
+
+def age(backend, kind, seconds):
+    for root, _, files in os.walk(os.path.join(backend.directory, kind)):
+        for name in files:
+            path = os.path.join(root, name)
+            os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+
+async def test_file_backend_shares_entries_and_purges(tmp_path):
+    writer, reader = FileBackend(str(tmp_path), ttl=60), FileBackend(str(tmp_path), ttl=60)
+    await writer.set('/?|0', entry())
+    assert (await reader.get('/?|0'))['body'] == b'<html></html>'
+
+    await reader.purge('products')
+    assert (await writer.tag_versions(['products']))['products'] > 0
+
+
+async def test_sweep_removes_expired_entries_and_old_tags(tmp_path):
+    backend = FileBackend(str(tmp_path), ttl=60)
+    await backend.set('old', entry())
+    await backend.purge('old-tag')
+    age(backend, 'entries', 61)
+    age(backend, 'tags', 121)
+    await backend.set('new', entry())
+    await backend.purge('new-tag')
+
+    assert backend.sweep() == 2
+    assert await backend.get('old') is None
+    assert await backend.get('new') is not None
+    versions = await backend.tag_versions(['old-tag', 'new-tag'])
+    assert versions['old-tag'] == 0 and versions['new-tag'] > 0
+
+
+async def test_tags_outlive_the_entries_they_invalidate(tmp_path):
+    backend = FileBackend(str(tmp_path), ttl=60)
+    await backend.purge('products')
+    age(backend, 'tags', 90)
+    assert backend.sweep() == 0
+
+
+async def test_set_sweeps_once_per_ttl(tmp_path):
+    backend = FileBackend(str(tmp_path), ttl=60)
+    await backend.set('old', entry())
+    age(backend, 'entries', 61)
+    await backend.set('new', entry())
+    assert await backend.get('old') is not None  # not due yet
+
+    backend._next_sweep = 0
+    await backend.set('newer', entry())
+    assert await backend.get('old') is None
+
+
+@pytest.fixture
+async def cached_client(anyio_backend, monkeypatch):
+    """Routes behind PageCacheMiddleware and the login middleware, as in main.py, on a fresh memory backend."""
+    import main  # noqa: F401, registers the user loader of the login middleware
+
+    monkeypatch.setattr(settings, 'PAGE_CACHE_ENABLED', True)
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    renders = []
+    app = FastAPI()
+
+    @app.get('/products')
+    async def products(request: Request):
+        renders.append(request.url.path)
+        cache_page(request, 'products')
+        return PlainTextResponse(f'render {len(renders)}')
+
+    @app.get('/consent')
+    async def consent(request: Request):
+        cache_page(request, 'products')
+        response = PlainTextResponse('consent')
+        response.set_cookie('consent', '1')
+        return response
+
+    app.add_middleware(PageCacheMiddleware)
+    manager.useRequest(app)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+
+
+async def test_repeat_get_is_a_hit(cached_client):
+    first, second = [await cached_client.get('/products') for _ in range(2)]
+    assert (first.headers['x-cache'], second.headers['x-cache']) == ('MISS', 'HIT')
+    assert second.text == first.text == 'render 1'
+
+
+async def test_purge_evicts_the_page(cached_client):
+    await cached_client.get('/products')
+    await purge('products')
+    response = await cached_client.get('/products')
+    assert (response.headers['x-cache'], response.text) == ('MISS', 'render 2')
+
+
+async def test_signed_in_pages_are_not_cached(cached_client):
+    await cached_client.get('/products')
+    log_in(cached_client, models.Users(id=1, name='user', email='page@example.com', is_active=True))
+    responses = [await cached_client.get('/products') for _ in range(2)]
+    assert [(response.headers.get('x-cache'), response.text) for response in responses] == [
+        (None, 'render 2'), (None, 'render 3')]
+
+
+async def test_responses_setting_cookies_are_not_cached(cached_client):
+    responses = [await cached_client.get('/consent') for _ in range(2)]
+    assert [response.headers.get('x-cache') for response in responses] == [None, None]
+    assert all(response.cookies['consent'] == '1' for response in responses)
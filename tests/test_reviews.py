@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import select
+
+from apps import models
+from tests.conftest import log_in
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def shop(db):
+    user = models.Users(name='user', email='review@example.com', is_active=True)
+    product = models.Product(name='product', price=10, category=models.Category(name='phones'))
+    db.add_all([user, product])
+    await db.commit()
+    return user, product
+
+
+async def reviews(db):
+    query = select(models.Review).execution_options(populate_existing=True)
+    return [(row.title, row.text, row.star) for row in await db.scalars(query)]
+
+
+async def test_star_then_review_is_one_review(client, db, shop):
+    user, product = shop
+    log_in(client, user)
+    for count in (4, 2):
+        response = await client.post(f'/star/{product.id}/{count}')
+        assert response.status_code == 303
+    assert await reviews(db) == [(None, None, 2)]
+
+    for title in ('good', 'better'):
+        await client.post(f'/review/{product.id}/', data={'title': title, 'text': 'text'})
+    assert await reviews(db) == [('better', 'text', 2)]
+
+
+async def test_star_out_of_range(client, db, shop):
+    user, product = shop
+    log_in(client, user)
+    response = await client.post(f'/star/{product.id}/6')
+    assert response.status_code == 400
+    assert await reviews(db) == []
@@ -0,0 +1,81 @@
+import pytest
+
+from apps import models
+from apps.search.memory import InvertedIndexSearch, similarity
+from apps.utils.catalog import load_products
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def products(db):
+    category = models.Category(name='phones')
+    rows = [
+        models.Product(name='Apple iPhone 14', description='Smartphone with a great camera', price=999,
+                       specifications={'Brand Name': 'Apple', 'Color': 'Black'}),
+        models.Product(name='Samsung Galaxy S23', description='Android phone, imports your Apple contacts',
+                       price=899, specifications={'Brand Name': 'Samsung', 'Color': 'Black'}),
+        models.Product(name='Phone case', description='Silicone case', price=19,
+                       specifications={'Brand Name': 'Apple', 'Color': 'Red'}),
+    ]
+    rows += [models.Product(name=f'Charger {n}', description='USB-C charger', price=20 + n) for n in range(8)]
+    for row in rows:
+        row.category = category
+    db.add_all(rows)
+    await db.commit()
+    return rows
+
+
+@pytest.fixture
+async def search(db, products):
+    backend = InvertedIndexSearch()
+    await backend.rebuild(db)
+    return backend
+
+
+def test_similarity_matches_pg_trgm():
+    assert similarity('word', 'word') == 1.0
+    assert similarity('iphone', 'iphon') == 0.625  # SELECT similarity('iphone', 'iphon')
+    assert similarity('apple', 'banana') == 0.0
+
+
+async def test_name_outranks_description_and_specifications(db, search, products):
+    page = await search.search(db, 'apple')
+    assert page.items == [products[0].id, products[1].id, products[2].id]
+
+
+async def test_typo_matches_by_trigrams(db, search, products):
+    page = await search.search(db, 'samsng galaxi')
+    assert page.items == [products[1].id]
+    assert (await search.search(db, 'xyzzy')).items == []
+
+
+async def test_pages_through_results(db, search, products):
+    first = await search.search(db, 'charger', limit=3)
+    second = await search.search(db, 'charger', first.next_cursor, limit=3)
+    third = await search.search(db, 'charger', second.next_cursor, limit=3)
+    back = await search.search(db, 'charger', second.prev_cursor, limit=3)
+
+    seen = first.items + second.items + third.items
+    assert sorted(seen) == sorted(product.id for product in products[3:])
+    assert third.next_cursor is None and first.prev_cursor is None
+    assert back.items == first.items
+
+
+async def test_index_and_remove_product(db, search, products):
+    product = models.Product(name='Apple AirPods', description='Earbuds', price=199,
+                             category_id=products[0].category_id)
+    db.add(product)
+    await db.commit()
+    search.index_product(product)
+    assert (await search.search(db, 'airpods')).items == [product.id]
+
+    search.remove_product(product.id)
+    assert (await search.search(db, 'airpods')).items == []
+    assert product.id not in (await search.search(db, 'apple')).items
+
+
+async def test_hits_load_in_rank_order(db, search, products):
+    page = await search.search(db, 'black apple')
+    loaded, images, liked = await load_products(db, page.items)
+    assert [product.name for product in loaded] == ['Apple iPhone 14', 'Samsung Galaxy S23', 'Phone case']
@@ -0,0 +1,96 @@
+import gzip
+import os
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from apps.utils.static import CompressedStaticFiles, IMMUTABLE, REVALIDATE, brotli
+
+pytestmark = pytest.mark.anyio
+
+CSS = b'body { color: #333; }\n' * 100
+
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'theme.css').write_bytes(CSS)
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' + bytes(2000))
+    return CompressedStaticFiles(directory=str(tmp_path))
+
+
+@pytest.fixture
+async def client(static):
+    app = Starlette(routes=[Mount('/static', static, name='static')])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+
+
+async def raw_get(client, url, **headers):
+    """The response with its body as sent, not decoded by httpx."""
+    async with client.stream('GET', url, headers=headers) as response:
+        return response, b''.join([chunk async for chunk in response.aiter_raw()])
+
+
+@pytest.mark.parametrize('accept, encoding, decode', [
+    pytest.param('gzip, deflate, br', 'br', brotli and brotli.decompress,
+                 marks=pytest.mark.skipif(brotli is None, reason='brotli is optional')),
+    ('gzip', 'gzip', gzip.decompress),
+    ('br;q=0, gzip', 'gzip', gzip.decompress),
+    ('identity', None, bytes),
+])
+async def test_negotiates_the_encoding(client, accept, encoding, decode):
+    response, body = await raw_get(client, '/static/css/theme.css', **{'accept-encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('content-encoding') == encoding
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.headers['content-type'].startswith('text/css')
+    assert decode(body) == CSS
+
+
+async def test_binary_files_are_not_compressed(client, static):
+    response, _ = await raw_get(client, '/static/logo.png', **{'accept-encoding': 'gzip, br'})
+    assert 'content-encoding' not in response.headers
+    assert static.manifest['logo.png']['encodings'] == []
+
+
+async def test_matching_etag_is_not_modified(client):
+    first = await client.get('/static/css/theme.css', headers={'accept-encoding': 'gzip'})
+    etag = first.headers['etag']
+    assert etag.endswith('-gzip"')
+
+    again = await client.get('/static/css/theme.css', headers={'accept-encoding': 'gzip', 'if-none-match': etag})
+    assert again.status_code == 304
+    assert again.headers['etag'] == etag and again.headers['vary'] == 'Accept-Encoding'
+
+    # the same ETag does not match another encoding of the file
+    other = await client.get('/static/css/theme.css', headers={'accept-encoding': 'br', 'if-none-match': etag})
+    assert other.status_code == 200
+
+
+async def test_fingerprinted_urls(client, static):
+    path = static.fingerprint('/css/theme.css')
+    assert path.startswith('css/theme.') and path.endswith('.css') and path != 'css/theme.css'
+    assert static.fingerprint('missing.css') == 'missing.css'
+
+    response = await client.get(f'/static/{path}')
+    assert (response.status_code, response.content) == (200, CSS)
+    assert response.headers['cache-control'] == IMMUTABLE
+
+    response = await client.get('/static/css/theme.css')
+    assert response.headers['cache-control'] == REVALIDATE
+    response = await client.get('/static/css/theme.0123456789ab.css')  # outdated fingerprint
+    assert (response.status_code, response.headers['cache-control']) == (200, REVALIDATE)
+
+
+async def test_manifest_is_rebuilt_at_startup_outside_the_static_root(tmp_path, static):
+    assert {'theme.css', 'theme.css.gz'} <= set(os.listdir(tmp_path / 'css'))
+    assert sorted(os.listdir(tmp_path)) == ['css', 'logo.png']
+
+    (tmp_path / 'css' / 'theme.css').write_bytes(CSS + b'a { color: red; }\n')
+    os.utime(tmp_path / 'css' / 'theme.css.gz', (0, 0))
+    restarted = CompressedStaticFiles(directory=str(tmp_path))
+    assert restarted.manifest['css/theme.css']['hash'] != static.manifest['css/theme.css']['hash']
+    assert gzip.decompress((tmp_path / 'css' / 'theme.css.gz').read_bytes()).endswith(b'a { color: red; }\n')
@@ -0,0 +1,59 @@
+import os
+
+import httpx
+import pytest
+
+from apps import models
+from apps.utils.uploads import BodySizeLimitMiddleware
+from config import settings
+from tests.conftest import log_in
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def limited_client(app):
+    transport = httpx.ASGITransport(app=BodySizeLimitMiddleware(app, max_size=1000))
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        yield client
+
+
+@pytest.fixture
+async def seller(db, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'MEDIA_ROOT', str(tmp_path / 'media'))
+    user = models.Users(name='seller', email='seller@example.com', is_active=True)
+    category = models.Category(name='phones')
+    db.add_all([user, category])
+    await db.commit()
+    log_in(client, user)
+    return user, category
+
+
+async def test_declared_length_over_limit(limited_client):
+    response = await limited_client.post('/add', content=b'x' * 1001, headers={'content-type': 'text/plain'})
+    assert response.status_code == 413
+
+
+async def test_streamed_body_over_limit(limited_client):
+    async def body():
+        for _ in range(10):
+            yield b'x' * 200
+
+    response = await limited_client.post('/add', content=body(), headers={'content-type': 'text/plain'})
+    assert response.status_code == 413
+
+
+async def test_body_within_limit_reaches_the_route(limited_client):
+    response = await limited_client.post('/add', data={'name': 'x'})
+    assert response.status_code == 404  # signed out: product_add's login check, not the limit
+
+
+async def test_file_over_limit(client, seller, monkeypatch):
+    user, category = seller
+    monkeypatch.setattr(settings, 'UPLOAD_MAX_SIZE', 100)
+    form = {'name': 'phone', 'description': 'new', 'price': '10', 'category_id': str(category.id)}
+    files = [('images', ('big.jpg', b'x' * 101, 'image/jpeg'))]
+
+    response = await client.post('/add', data=form, files=files)
+    assert response.status_code == 413
+    assert os.listdir(os.path.join(settings.MEDIA_ROOT, 'tmp')) == []
@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import logging
+import signal
+
+from apps.utils import images  # noqa: registers its jobs
+from apps.utils.jobs import JobWorker, Session, create_tables, job_status
+from apps.utils.outbox import outbox
+from config import settings
+
+
+async def run(concurrency: int):
+    await create_tables()
+
+    worker = JobWorker(
+        concurrency=concurrency,
+        poll_interval=settings.JOB_POLL_INTERVAL,
+        timeout=settings.JOB_TIMEOUT,
+        backoff=settings.JOB_RETRY_BACKOFF
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    outbox.start()
+    try:
+        await worker.run()
+    finally:
+        await outbox.stop()
+        images.shutdown_executor()
+        logging.info('worker stopped: %s, outbox %s', worker.stats(), outbox.stats())
+
+
+async def status():
+    async with Session() as db:
+        for name, state, count, oldest in await job_status(db):
+            print(f'{name:30} {state:8} {count:8} {oldest:%Y-%m-%d %H:%M:%S}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run background jobs and drain the email outbox.')
+    parser.add_argument('--concurrency', type=int, default=settings.JOB_CONCURRENCY)
+    parser.add_argument('--status', action='store_true', help='print job counts per name and status, then exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    asyncio.run(status() if args.status else run(args.concurrency))